@@ -0,0 +1,85 @@
+"""
+Times the spec round trips that fito does all the time: to_dict, dict2spec (every data store read), copy, replace and
+bind. Run it from the root of the repository:
+
+    python benchmarks/spec_roundtrip.py [--repeat 5000]
+
+It only uses the public API, so it can also be run against older versions to compare them
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fito import Spec, SpecField, PrimitiveField
+from fito.specs.fields import NumericField, SpecCollection, UnboundPrimitiveField
+
+
+class Dataset(Spec):
+    name = PrimitiveField(0)
+    version = NumericField(1, default=1)
+    columns = PrimitiveField(default=None)
+
+
+class Features(Spec):
+    dataset = SpecField(0)
+    window = NumericField(1, default=7)
+    lags = PrimitiveField(default=(1, 2, 3))
+
+
+class Model(Spec):
+    features = SpecCollection(0)
+    alpha = NumericField(default=0.1)
+    verbose = PrimitiveField(default=False, serialize=False)
+
+
+class Experiment(Spec):
+    model = SpecField(0)
+    seed = NumericField(default=42)
+    fold = UnboundPrimitiveField(0)
+
+
+def build_tree():
+    """
+    An experiment of 8 specs
+    """
+    datasets = [Dataset('sales', columns=['a', 'b']), Dataset('weather'), Dataset('calendar', version=2)]
+    features = [Features(datasets[0]), Features(datasets[1], window=14), Features(datasets[2], lags=(7,))]
+    return Experiment(Model(features, alpha=0.5))
+
+
+def timeit(func, repeat):
+    start = time.time()
+    for _ in xrange(repeat): func()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5000)
+    args = parser.parse_args()
+
+    # The specs are defined in __main__, that is fine here
+    warnings.simplefilter('ignore')
+
+    spec = build_tree()
+    spec_dict = spec.to_dict()
+    bound = spec.bind(fold=3)
+
+    cases = [
+        ('to_dict', lambda: spec.to_dict()),
+        ('dict2spec', lambda: Spec.dict2spec(spec_dict)),
+        ('dict2spec + key', lambda: Spec.dict2spec(spec_dict).key),
+        ('copy', lambda: spec.copy()),
+        ('replace', lambda: bound.replace(seed=1)),
+        ('bind', lambda: spec.bind(fold=3)),
+    ]
+    for name, func in cases:
+        print '{:<20}{:.3f}s'.format(name, timeit(func, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,12 @@
 from file import FileDataStore
-try:
-    from mongo import MongoHashMap
-except ImportError:
-    pass
-from dict_ds import DictDataStore
\ No newline at end of file
+from dict_ds import DictDataStore
+from fito.lazy_module import make_lazy
+
+
+def _import_mongo_hash_map():
+    # pymongo is only imported when needed
+    from fito.data_store.mongo import MongoHashMap
+    return MongoHashMap
+
+
+make_lazy(__name__, MongoHashMap=_import_mongo_hash_map)
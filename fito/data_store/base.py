@@ -1,16 +1,25 @@
 from fito import config
+import heapq
 import warnings
+from collections import deque
 from functools import wraps
+from itertools import imap, islice
 
 from fito import Spec
-from fito.data_store.rehash_ui import RehashUI
 from fito.operation_runner import FifoCache, OperationRunner
 from fito.operations.decorate import as_operation
 from fito.specs.base import get_import_path
 from fito.specs.fields import NumericField, PrimitiveField
+from fito.specs.lazy import LazySpec
 from fito.specs.utils import matching_fields
 
 
+def get_rehash_ui():
+    # The interactive rehash depends on cmd2, it is only imported when enabled
+    from fito.data_store.rehash_ui import RehashUI
+    return RehashUI
+
+
 class BaseDataStore(OperationRunner):
     """
     Base class for all data stores, to implement a backend you need to implement
@@ -38,21 +47,33 @@ class BaseDataStore(OperationRunner):
     @classmethod
     def get_key(cls, spec):
         if isinstance(spec, Spec):
-            return spec.key
+            # Stores need to be able to load the key back
+            return spec.serialized_key
         else:
             assert isinstance(spec, dict)
             return Spec._dict2key(spec)
 
+    @classmethod
+    def get_digest(cls, spec):
+        if isinstance(spec, Spec):
+            return spec.digest
+        else:
+            assert isinstance(spec, dict)
+            return Spec.dict2digest(spec)
+
     def get(self, spec):
         """
         Gets an operation from this data store.
         """
+        # Lazy specs are looked up by their dictionary, so that they are not built
+        if isinstance(spec, LazySpec): spec = spec.to_dict()
+
         def _get():
             try:
                 return self._get(spec)
             except KeyError, e:
                 # TODO: I don't like puting RehashUI.ignored_specs here
-                if config.interactive_rehash and spec not in RehashUI.ignored_specs:
+                if config.interactive_rehash and spec not in get_rehash_ui().ignored_specs:
                     # Interactive rehash has been enabled and this spec has not been processed
                     # Trigger interactive rehash
                     if self.interactive_rehash(spec):
@@ -98,17 +119,114 @@ class BaseDataStore(OperationRunner):
         """
         raise NotImplementedError()
 
-    def iterkeys(self, raw=False):
+    def iterkeys(self, raw=False, lazy=False):
         """
         Iterates over the keys of the data store
         :param raw: Whether to return raw documents or specs
+        :param lazy: Whether to return :py:class:`LazySpec` instances instead of specs. Useful to filter the keys by
+        type or by field without building every spec
+        """
+        raise NotImplementedError()
+
+    def scan(self, where=None, values=False, raw=False, lazy=False, batch_size=100, n_threads=0, on_error=None):
+        """
+        Streams the contents of the data store, holding at most a few batches in memory
+
+        >>> for spec, value in ds.scan(where=lambda d: d['alpha'] > 0.5, values=True, n_threads=4):
+        ...     pass
+
+        :param where: Predicate over the key dictionaries (the output of :py:meth:`Spec.to_dict`). Entries that do not
+        match are discarded before their specs are built and before their values are read
+        :param values: Whether to yield (key, value) pairs instead of keys
+        :param raw: Whether to return the key dictionaries instead of specs
+        :param lazy: Whether to return :py:class:`LazySpec` instances instead of specs
+        :param batch_size: How many entries are read at once
+        :param n_threads: When greater than zero, the batches are read by that many threads, so that reading keeps going
+        while the previous batches are processed. Specs are always built by the calling thread
+        :param on_error: Function called with the key dictionary and the exception when a value can not be read (e.g. it
+        is corrupt). What it returns is yielded as the value. By default the exception is raised
+        """
+        read = lambda batch: self._scan_read(batch, where, values, on_error)
+        batches = _batches(self._scan_items(values), batch_size)
+        batches = imap(read, batches) if n_threads <= 0 else _imap_bounded(read, batches, n_threads)
+
+        for batch in batches:
+            if raw:
+                keys = [key_dict for _, key_dict, _ in batch]
+            elif lazy:
+                keys = [LazySpec(key_dict) for _, key_dict, _ in batch]
+            else:
+                keys = self._scan_specs(batch)
+
+            for key, (_, _, value) in zip(keys, batch):
+                # Keys that can not be loaded might be skipped
+                if key is None: continue
+                yield (key, value) if values else key
+
+    def _scan_items(self, values):
+        """
+        Abstract method, cheaply enumerates the entries of the data store (e.g. paths or documents) for :py:meth:`scan`
+
+        :param values: Whether the values are going to be read
+        """
+        raise NotImplementedError()
+
+    def _scan_key_dict(self, item):
+        """
+        Abstract method, reads the key dictionary of an entry given by `_scan_items`.
+        Should raise KeyError if the entry is gone or can not be read, so that it is skipped
+        """
+        raise NotImplementedError()
+
+    def _scan_value(self, item):
+        """
+        Abstract method, reads the value of an entry given by `_scan_items`. Should raise KeyError like `_scan_key_dict`
         """
         raise NotImplementedError()
 
+    def _scan_read(self, batch, where, values, on_error=None):
+        """
+        Does the I/O of a batch of entries, it might run in a worker thread
+        :return: List of (item, key dict, value or None) for the entries that match `where`
+        """
+        res = []
+        for item in batch:
+            try:
+                key_dict = self._scan_key_dict(item)
+                if where is not None and not where(key_dict): continue
+                value = self._read_value(item, key_dict, on_error) if values else None
+            except KeyError:
+                continue
+
+            res.append((item, key_dict, value))
+        return res
+
+    def _read_value(self, item, key_dict, on_error):
+        try:
+            return self._scan_value(item)
+        except KeyError:
+            raise
+        except Exception, e:
+            if on_error is None: raise
+            return on_error(key_dict, e)
+
+    def _scan_specs(self, batch):
+        """
+        Builds the specs of a batch read by `_scan_read`. It gives None for the ones that should be skipped
+        """
+        return list(Spec.dict2spec_many(
+            (key_dict for _, key_dict, _ in batch), on_error=self._on_invalid_key, batch_size=len(batch) or 1
+        ))
+
+    def _on_invalid_key(self, spec_dict, e):
+        raise e
+
     def remove(self, spec):
         """
         Removes a spec from a data store. Updates the get_cache is necessary
         """
+        if isinstance(spec, LazySpec): spec = spec.to_dict()
+
         if self.get_cache is not None:
             self.get_cache.remove(spec)
 
@@ -135,39 +253,73 @@ class BaseDataStore(OperationRunner):
     def __contains__(self, spec):
         return self.get_or_none(spec) is not None
 
+    def copy_value(self, spec, new_spec, source=None):
+        """
+        Saves the value of `spec` under `new_spec`. Stores that can reuse what is already stored, instead of loading the
+        value and saving it again, override it
+
+        :param source: The store that has `spec`, defaults to this one
+        """
+        source = self if source is None else source
+        self.save(new_spec, source.get(spec))
+
+    def _copies_without_loading(self, source):
+        """
+        Whether `copy_value` can copy the entries of `source` without loading their values
+        """
+        return False
+
     def autosave(self, *args, **kwargs):
         kwargs['cache_on'] = self
         return AutosavedFunction(*args, **kwargs)
 
-    def refactor(self, refactor_operation, out_data_store, permissive=False):
-        # TODO: rewrite iterkeys, it's horrible!
-        for id, doc in self.iterkeys(raw=True):
+    def refactor(self, refactor_operation, out_data_store, permissive=False, n_threads=0):
+        """
+        :param n_threads: Number of threads that read the values while the previous ones are refactored and saved
+        """
+        # Values are not read if they can be copied as they are stored
+        values = not out_data_store._copies_without_loading(self)
+        # Values that can not be read are handled with the rest of the errors of their entry
+        items = self.scan(raw=True, values=values, n_threads=n_threads, on_error=lambda doc, e: _FailedRead(e))
+
+        for item in items:
+            doc, value = item if values else (item, None)
             try:
+                if isinstance(value, _FailedRead): raise value.error
                 refactored_doc = refactor_operation.bind(doc=doc).execute()
                 spec = Spec.dict2spec(refactored_doc)
-                out_data_store[spec] = self[id]
+                if values:
+                    out_data_store[spec] = value
+                else:
+                    out_data_store.copy_value(doc, spec, source=self)
             except Exception, e:
                 if permissive:
                     warnings.warn(' '.join(e.args))
                 else:
                     raise e
 
-    def find_similar(self, spec):
-        res = []
+    def find_similar(self, spec, limit=None):
+        """
+        :param limit: If given, only the `limit` most similar ones are kept, so memory does not grow with the store
+        :return: List of (spec, similarity) pairs, the most similar first
+        """
         spec_dict = spec.to_dict() if isinstance(spec, Spec) else spec
-        for id, other_spec_dict in self.iterkeys(raw=True):
-            similarity = matching_fields(spec_dict, other_spec_dict)
 
-            if similarity > 0:
-                try:
-                    res.append((Spec.dict2spec(other_spec_dict), similarity))
-                except:
-                    # TODO: improve how exceptions are risen
-                    res.append((other_spec_dict, similarity))
+        similar = (
+            (other_spec_dict, matching_fields(spec_dict, other_spec_dict))
+            for other_spec_dict in self.scan(raw=True)
+        )
+        similar = (x for x in similar if x[1] > 0)
 
-        res.sort(key=lambda x: -x[1])
+        if limit is None:
+            similar = sorted(similar, key=lambda x: -x[1])
+        else:
+            similar = heapq.nlargest(limit, similar, key=lambda x: x[1])
 
-        return res
+        # TODO: improve how exceptions are risen
+        # The documents that can not be loaded are returned as they are
+        specs = Spec.dict2spec_many((d for d, _ in similar), on_error=lambda d, e: d)
+        return [(spec, similarity) for spec, (_, similarity) in zip(specs, similar)]
 
     def interactive_rehash(self, spec):
         similar = self.find_similar(spec)
@@ -175,13 +327,46 @@ class BaseDataStore(OperationRunner):
             # Disable interactive rehash functionality
             # This is obviously not thread safe
             config.interactive_rehash = False
-            RehashUI(data_store=self, spec=spec).cmdloop()
+            get_rehash_ui()(data_store=self, spec=spec).cmdloop()
             config.interactive_rehash = True
             return True
         else:
             return False
 
 
+class _FailedRead(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch: return
+        yield batch
+
+
+def _imap_bounded(func, iterable, n_threads):
+    """
+    Same as `imap(func, iterable)`, computed by a pool of threads.
+    Unlike `ThreadPool.imap`, it reads at most `2 * n_threads` elements of `iterable` ahead of the consumer
+    """
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(n_threads)
+    try:
+        pending = deque()
+        for args in iterable:
+            pending.append(pool.apply_async(func, (args,)))
+            if len(pending) >= 2 * n_threads:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
 class AutosavedFunction(as_operation):
     cache_on = PrimitiveField()  # make cache_on a required parameter
 
@@ -1,6 +1,7 @@
 from fito import Spec
 from fito.data_store.base import BaseDataStore
 from fito.specs import base
+from fito.specs.lazy import LazySpec
 
 
 class DictDataStore(BaseDataStore):
@@ -22,13 +23,28 @@ class DictDataStore(BaseDataStore):
         if spec not in self.data: raise KeyError("Spec not found: {}".format(spec))
         return self.data.get(spec)
 
-    def iterkeys(self, raw=False):
+    def iterkeys(self, raw=False, lazy=False):
         for key in self.data.iterkeys():
             if raw:
                 yield key, key.to_dict()
+            elif lazy:
+                yield LazySpec(key.to_dict())
             else:
                 yield key
 
+    def _scan_items(self, values):
+        return self.data.iteritems()
+
+    def _scan_key_dict(self, item):
+        return item[0].to_dict()
+
+    def _scan_value(self, item):
+        return item[1]
+
+    def _scan_specs(self, batch):
+        # The keys already are specs
+        return [spec for (spec, _), _, _ in batch]
+
     def clean(self):
         self.data = {}
 
@@ -1,19 +1,27 @@
+import cPickle
+import errno
+import fcntl
 import json
 import mmh3
 import os
 import pickle
 import shutil
+import struct
 import traceback
+import uuid
 import warnings
-from time import time, sleep
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
 
-import yaml
 from fito import PrimitiveField
 from fito import Spec
 from fito import SpecField
 from fito import config
-from fito.data_store.base import BaseDataStore
-from fito.data_store.rehash_ui import RehashUI
+from fito.data_store import packs
+from fito.data_store.base import BaseDataStore, get_rehash_ui
+from fito.data_store.file_index import KeyIndex
+from fito.specs.lazy import LazySpec
+from fito.type_registry import TypeRegistry
 
 
 class Serializer(Spec):
@@ -23,6 +31,15 @@ class Serializer(Spec):
 
     def exists(self, subdir): raise NotImplemented()
 
+    def dumps(self, obj):
+        """
+        :return: `obj` serialized into a string, so that it can be packed with other small entries (see
+        `FileDataStore.pack_threshold`). None if this serializer can only save it into a subdir
+        """
+        return None
+
+    def loads(self, data): raise NotImplementedError()
+
 
 class SingleFileSerializer(Serializer):
     def get_fname(self, subdir): raise NotImplemented()
@@ -43,6 +60,12 @@ class PickleSerializer(SingleFileSerializer):
         with open(self.get_fname(subdir)) as f:
             return pickle.load(f)
 
+    def dumps(self, obj):
+        return cPickle.dumps(obj, 2)
+
+    def loads(self, data):
+        return cPickle.loads(data)
+
 
 class RawSerializer(SingleFileSerializer):
     def get_fname(self, subdir):
@@ -56,17 +79,417 @@ class RawSerializer(SingleFileSerializer):
         with open(self.get_fname(subdir)) as f:
             return f.read()
 
+    def dumps(self, obj):
+        return obj if isinstance(obj, str) else None
+
+    def loads(self, data):
+        return data
+
+
+class CompressedSerializer(SingleFileSerializer):
+    """
+    Base class for the serializers that compress their output. Data is compressed while it is written and decompressed
+    while it is read, so the whole compressed copy is never held in memory
+
+    :param codec: Either 'gzip' (zlib), 'bz2' or 'lzma'. lzma needs the backports.lzma package on python 2
+    :param level: Compression level, from 0 (or 1 for bz2) to 9. Defaults to the one of the codec
+    """
+    codec = PrimitiveField(0, default='gzip')
+    level = PrimitiveField(1, default=None)
+
+    extensions = {'gzip': 'gz', 'bz2': 'bz2', 'lzma': 'xz'}
+    default_levels = {'gzip': 6, 'bz2': 9, 'lzma': 6}
+
+    def __init__(self, *args, **kwargs):
+        super(CompressedSerializer, self).__init__(*args, **kwargs)
+        if self.codec not in self.extensions:
+            raise ValueError("Unknown codec {}, use one of {}".format(self.codec, sorted(self.extensions)))
+
+    def get_fname(self, subdir):
+        return os.path.join(subdir, '{}.{}'.format(self.base_fname, self.extensions[self.codec]))
+
+    def open(self, fname, mode):
+        level = self.default_levels[self.codec] if self.level is None else self.level
+
+        if self.codec == 'gzip':
+            import gzip
+            return gzip.GzipFile(fname, mode, compresslevel=level)
+
+        elif self.codec == 'bz2':
+            import bz2
+            return bz2.BZ2File(fname, mode, compresslevel=level)
+
+        else:
+            try:
+                import lzma
+            except ImportError:
+                from backports import lzma
+
+            if mode.startswith('r'): return lzma.LZMAFile(fname, mode)
+            return lzma.LZMAFile(fname, mode, preset=level)
+
+
+class CompressedPickleSerializer(CompressedSerializer):
+    base_fname = 'obj.pkl'
+
+    def save(self, obj, subdir):
+        # cPickle writes to file like objects in chunks, so they are compressed as the object is pickled
+        with self.open(self.get_fname(subdir), 'wb') as f:
+            cPickle.dump(obj, f, 2)
+
+    def load(self, subdir):
+        with self.open(self.get_fname(subdir), 'rb') as f:
+            return cPickle.load(f)
+
+
+class CompressedRawSerializer(CompressedSerializer):
+    base_fname = 'obj.raw'
+
+    def save(self, obj, subdir):
+        with self.open(self.get_fname(subdir), 'wb') as f:
+            f.write(obj)
+
+    def load(self, subdir):
+        with self.open(self.get_fname(subdir), 'rb') as f:
+            return f.read()
+
+
+class NumpySerializer(Serializer):
+    """
+    Saves numpy arrays, or dicts, tuples or lists of them, as .npy files. They are loaded memory mapped, so processes
+    reading the same entry share the page cache instead of each one holding a copy
+
+    :param mmap_mode: How arrays are loaded, see `numpy.load`. The default, 'r', maps them read only. None loads them in
+    memory
+    """
+    mmap_mode = PrimitiveField(0, default='r', serialize=False)
+
+    def get_manifest_fname(self, subdir):
+        return os.path.join(subdir, 'arrays.json')
+
+    def get_array_fname(self, subdir, i):
+        return os.path.join(subdir, 'arr_{}.npy'.format(i))
+
+    def exists(self, subdir):
+        return os.path.exists(self.get_manifest_fname(subdir))
+
+    def save(self, obj, subdir):
+        import numpy as np
+
+        keys = None
+        if isinstance(obj, np.ndarray):
+            kind, arrays = 'array', [obj]
+        elif isinstance(obj, dict):
+            if not all(isinstance(k, basestring) for k in obj):
+                raise TypeError("NumpySerializer can only save dicts whose keys are strings")
+            kind, keys = 'dict', list(obj)
+            arrays = [obj[k] for k in keys]
+        elif isinstance(obj, (tuple, list)):
+            kind, arrays = type(obj).__name__, list(obj)
+        else:
+            raise TypeError(
+                "NumpySerializer can only save arrays, and dicts, tuples or lists of arrays. Received {}".format(
+                    type(obj).__name__
+                )
+            )
+
+        for i, arr in enumerate(arrays):
+            if not isinstance(arr, np.ndarray) or arr.dtype.hasobject:
+                raise TypeError("NumpySerializer can not save {!r}, object arrays can not be memory mapped".format(arr))
+            np.save(self.get_array_fname(subdir, i), arr, allow_pickle=False)
+
+        # The manifest is written last, it tells whether the entry exists
+        with open(self.get_manifest_fname(subdir), 'w') as f:
+            json.dump({'kind': kind, 'keys': keys, 'size': len(arrays)}, f)
+
+    def load(self, subdir):
+        with open(self.get_manifest_fname(subdir)) as f:
+            manifest = json.load(f)
+
+        arrays = [self._load_array(self.get_array_fname(subdir, i)) for i in xrange(manifest['size'])]
+
+        kind = manifest['kind']
+        if kind == 'array':
+            return arrays[0]
+        elif kind == 'dict':
+            return dict(zip(manifest['keys'], arrays))
+        elif kind == 'tuple':
+            return tuple(arrays)
+        else:
+            return arrays
+
+    def _load_array(self, fname):
+        import numpy as np
+        try:
+            return np.load(fname, mmap_mode=self.mmap_mode, allow_pickle=False)
+        except ValueError:
+            # Empty arrays can not be memory mapped
+            if self.mmap_mode is None: raise
+            return np.load(fname, allow_pickle=False)
+
+
+class DataFrameSerializer(Serializer):
+    """
+    Saves pandas DataFrames column by column, so that a subset of the columns can be loaded with
+    `data_store.get(spec, columns=[...])`
+
+    :param format: How new entries are saved, either 'npy', that saves a .npy file per column, or 'parquet', that needs
+    pyarrow. Each entry records its format, so entries of either one are loaded
+    """
+    format = PrimitiveField(0, default='npy')
+
+    # Whether load takes the columns parameter
+    supports_columns = True
+
+    def __init__(self, *args, **kwargs):
+        super(DataFrameSerializer, self).__init__(*args, **kwargs)
+        if self.format not in ('parquet', 'npy'):
+            raise ValueError("Unknown format {}, use either 'parquet' or 'npy'".format(self.format))
+
+    def get_manifest_fname(self, subdir):
+        return os.path.join(subdir, 'columns.json')
+
+    def exists(self, subdir):
+        return os.path.exists(self.get_manifest_fname(subdir))
+
+    def save(self, df, subdir):
+        import pandas as pd
+        if not isinstance(df, pd.DataFrame):
+            raise TypeError("DataFrameSerializer can only save DataFrames. Received {}".format(type(df).__name__))
+
+        columns = list(df.columns)
+        valid_labels = all(isinstance(c, (basestring, int, long, float, bool)) for c in columns)
+        if not valid_labels or len(set(columns)) != len(columns):
+            raise TypeError("DataFrameSerializer needs unique column labels that are strings or numbers")
+
+        manifest = {'format': self.format, 'columns': columns, 'columns_name': df.columns.name}
+        if self.format == 'parquet':
+            df.to_parquet(os.path.join(subdir, 'df.parquet'), engine='pyarrow')
+        else:
+            manifest['index'] = self._save_index(df.index, subdir)
+            manifest['kinds'] = [
+                _save_values(df.iloc[:, i], os.path.join(subdir, 'col_{}'.format(i))) for i in xrange(len(columns))
+            ]
+
+        # The manifest is written last, it tells whether the entry exists
+        with open(self.get_manifest_fname(subdir), 'w') as f:
+            json.dump(manifest, f)
+
+    def load(self, subdir, columns=None):
+        """
+        :param columns: The columns to load, in that order. Defaults to all of them
+        """
+        import pandas as pd
+
+        with open(self.get_manifest_fname(subdir)) as f:
+            manifest = json.load(f)
+
+        if columns is None:
+            columns = manifest['columns']
+        else:
+            missing = set(columns).difference(manifest['columns'])
+            if missing: raise KeyError("Columns not found: {}".format(sorted(missing)))
+
+        if manifest['format'] == 'parquet':
+            res = pd.read_parquet(os.path.join(subdir, 'df.parquet'), engine='pyarrow', columns=list(columns))
+        else:
+            positions = {c: i for i, c in enumerate(manifest['columns'])}
+            index = self._load_index(manifest['index'], subdir)
+
+            data = OrderedDict()
+            for c in columns:
+                i = positions[c]
+                values = _load_values(manifest['kinds'][i], os.path.join(subdir, 'col_{}'.format(i)))
+                if isinstance(values, pd.Series): values.index = index
+                data[c] = values
+            res = pd.DataFrame(data, index=index, columns=list(columns))
+
+        res.columns.name = manifest['columns_name']
+        return res
+
+    def _save_index(self, index, subdir):
+        import pandas as pd
+        if isinstance(index, pd.RangeIndex) and index.equals(pd.RangeIndex(len(index))):
+            return {'kind': 'default', 'size': len(index), 'name': index.name}
+        else:
+            return {'kind': _save_values(index, os.path.join(subdir, 'index')), 'name': index.name}
+
+    def _load_index(self, index_manifest, subdir):
+        import pandas as pd
+        kind = index_manifest['kind']
+        if kind == 'default':
+            return pd.RangeIndex(index_manifest['size'], name=index_manifest['name'])
+
+        res = _load_values(kind, os.path.join(subdir, 'index'))
+        return pd.Index(res, name=index_manifest['name']) if kind == 'npy' else res
+
+
+def _save_values(values, fname):
+    """
+    Saves the values of a Series or an Index. Numpy arrays of primitive types are saved as .npy, the rest (e.g. strings,
+    categoricals) are pickled
+    :return: The kind of file, to be given to `_load_values`
+    """
+    import numpy as np
+    array = values.values
+    # Extension types (e.g. categoricals, datetimes with time zone) have dtypes that are not numpy's
+    if type(array) is np.ndarray and isinstance(values.dtype, np.dtype) and not array.dtype.hasobject:
+        np.save(fname + '.npy', array, allow_pickle=False)
+        return 'npy'
+    else:
+        # The index is saved once, not with each column
+        if hasattr(values, 'reset_index'): values = values.reset_index(drop=True)
+        with open(fname + '.pkl', 'wb') as f:
+            cPickle.dump(values, f, 2)
+        return 'pkl'
+
+
+def _load_values(kind, fname):
+    if kind == 'npy':
+        import numpy as np
+        return np.load(fname + '.npy', allow_pickle=False)
+    else:
+        with open(fname + '.pkl', 'rb') as f:
+            return cPickle.load(f)
+
+
+class AutoSerializer(Serializer):
+    """
+    Picks the serializer of each entry by the type of its value, from the ones registered with
+    :py:meth:`AutoSerializer.register`. The chosen serializer is written next to the value, so it is known when loading.
+
+    By default numpy arrays use :py:class:`NumpySerializer`, DataFrames :py:class:`DataFrameSerializer`, strings
+    :py:class:`RawSerializer`, and the rest `fallback`
+
+    :param fallback: Serializer of the values whose type was not registered. Defaults to :py:class:`PickleSerializer`
+    """
+    fallback = SpecField(default=None, base_type=Serializer)
+
+    # It works when the serializer of the entry supports it
+    supports_columns = True
+
+    registry = TypeRegistry()
+
+    # Contents of the sidecar files -> serializer
+    _sidecar_cache = {}
+
+    def __init__(self, *args, **kwargs):
+        super(AutoSerializer, self).__init__(*args, **kwargs)
+        if self.fallback is None: self.fallback = PickleSerializer()
+
+    # Factory -> the serializer it built
+    _built_serializers = {}
+
+    @classmethod
+    def register(cls, type, serializer):
+        """
+        :param type: The class of the values, or its import path ('module:Class'). Subclasses use the same serializer
+        :param serializer: A :py:class:`Serializer` instance, or a function without arguments that builds it. The
+        function is called the first time a value of `type` is saved
+        """
+        cls.registry.register(type, serializer)
+
+    @classmethod
+    def unregister(cls, type):
+        cls.registry.unregister(type)
+
+    def get_sidecar_fname(self, subdir):
+        return os.path.join(subdir, 'serializer.json')
+
+    def exists(self, subdir):
+        return os.path.exists(self.get_sidecar_fname(subdir))
+
+    def save(self, obj, subdir):
+        serializer = self.get_serializer(obj)
+        serializer.save(obj, subdir)
+
+        # The sidecar is written last, it tells whether the entry exists
+        with open(self.get_sidecar_fname(subdir), 'w') as f:
+            serializer.json.dump(f)
+
+    def load(self, subdir, columns=None):
+        serializer = self.get_entry_serializer(subdir)
+        if columns is None: return serializer.load(subdir)
+
+        if not getattr(serializer, 'supports_columns', False):
+            raise ValueError("{} can not load a subset of columns".format(type(serializer).__name__))
+        return serializer.load(subdir, columns=columns)
+
+    def dumps(self, obj):
+        serializer = self.get_serializer(obj)
+        data = serializer.dumps(obj)
+        if data is None: return None
+
+        # The sidecar goes first, preceded by its length
+        sidecar = serializer.json.dumps()
+        return _sidecar_length.pack(len(sidecar)) + sidecar + data
+
+    def loads(self, data):
+        size, = _sidecar_length.unpack_from(data)
+        start = _sidecar_length.size
+        return self._load_sidecar(data[start:start + size]).loads(data[start + size:])
+
+    def get_serializer(self, obj):
+        """
+        :return: The serializer for `obj`
+        """
+        res = self.registry.get(type(obj))
+        if res is None: return self.fallback
+        if isinstance(res, Serializer): return res
+
+        built = self._built_serializers.get(res)
+        if built is None: built = self._built_serializers[res] = res()
+        return built
+
+    def get_entry_serializer(self, subdir):
+        with open(self.get_sidecar_fname(subdir)) as f:
+            return self._load_sidecar(f.read())
+
+    def _load_sidecar(self, sidecar):
+        res = self._sidecar_cache.get(sidecar)
+        if res is None:
+            res = self._sidecar_cache[sidecar] = Serializer.from_json().loads(sidecar)
+        return res
+
+
+_sidecar_length = struct.Struct('<I')
+
+AutoSerializer.register('numpy:ndarray', NumpySerializer())
+AutoSerializer.register('pandas.core.frame:DataFrame', DataFrameSerializer)
+AutoSerializer.register(str, RawSerializer())
+
 
 class FileDataStore(BaseDataStore):
+    """
+    Stores each entry in a subdir holding its key and its serialized value.
+
+    Many processes can write to the same store: entries are written into a temporary directory and published with a
+    rename, so readers either see a whole entry or none of it.
+
+    With `pack_threshold` set, small entries are appended to segment files instead (see fito.data_store.packs), so that
+    saving many scalars does not create a few files for each one. Run :py:meth:`compact_packs` to reclaim the space of
+    the packed entries that were removed or replaced
+    """
     path = PrimitiveField(0)
     split_keys = PrimitiveField(default=True)
     serializer = SpecField(default=None, base_type=Serializer)
     use_class_name = PrimitiveField(default=False, help='Whether the first level should be the class name')
+    use_index = PrimitiveField(
+        default=True,
+        help='Whether to keep an index of the keys (see fito.data_store.file_index). It only applies to new stores, '
+             'use rebuild_index to add one to an existing store'
+    )
+    pack_threshold = PrimitiveField(
+        default=None,
+        help='Entries whose serialized value has less bytes than this are packed into segment files. Needs the index '
+             'and a serializer that implements dumps'
+    )
 
     def __init__(self, *args, **kwargs):
+        import yaml
         super(FileDataStore, self).__init__(*args, **kwargs)
 
-        if not os.path.exists(self.path): os.makedirs(self.path)
+        _makedirs(self.path)
 
         conf_file = os.path.join(self.path, 'conf.yaml')
         if os.path.exists(conf_file):
@@ -78,9 +501,14 @@ class FileDataStore(BaseDataStore):
                 warnings.warn("Old conf.yaml format. Please update it to the new format")
                 conf_serializer = Spec.dict2spec(conf)
                 conf_use_class_name = False
+                conf_key_hash = 'mmh3'
+                conf_use_index = False
             else:
                 conf_serializer = Spec.dict2spec(conf['serializer'])
                 conf_use_class_name = conf.get('use_class_name', False)
+                # Stores created before digests were introduced hash the whole key with mmh3
+                conf_key_hash = conf.get('key_hash', 'mmh3')
+                conf_use_index = conf.get('use_index', False)
 
             if conf_use_class_name != self.use_class_name:
                 raise RuntimeError(
@@ -99,56 +527,243 @@ class FileDataStore(BaseDataStore):
                     )
                 )
 
-            self.serializer = conf_serializer
+            # Keep the serializer given, it might have fields that are not serialized (e.g. NumpySerializer.mmap_mode)
+            if self.serializer is None: self.serializer = conf_serializer
             self.use_class_name = conf_use_class_name
+            self.key_hash = conf_key_hash
+            self.use_index = conf_use_index
         else:
             if self.serializer is None: self.serializer = PickleSerializer()
+            self.key_hash = 'digest'
+            self._write_conf()
 
-            with open(conf_file, 'w') as f:
-                yaml.dump(
-                    {
-                        'serializer': self.serializer.to_dict(),
-                        'use_class_name': self.use_class_name
-                    },
-                    f
-                )
+        self.index = KeyIndex(self.path) if self.use_index else None
+        if self.pack_threshold is not None and self.index is None:
+            raise ValueError("pack_threshold needs the index, use rebuild_index to add one to this store")
+
+        self.packs_dir = os.path.join(self.path, '.packs')
+        self._segment_writer = None
+
+    @property
+    def _segments(self):
+        # Built on first use, only stores that pack entries need it
+        if self._segment_writer is None: self._segment_writer = packs.SegmentWriter(self.packs_dir)
+        return self._segment_writer
+
+    def __getstate__(self):
+        # The segment writer holds a lock and the segment this process appends to, copies start their own
+        state = self.__dict__.copy()
+        state['_segment_writer'] = None
+        return state
+
+    def _write_conf(self):
+        import yaml
+        with open(os.path.join(self.path, 'conf.yaml'), 'w') as f:
+            yaml.dump(
+                {
+                    'serializer': self.serializer.to_dict(),
+                    'use_class_name': self.use_class_name,
+                    'key_hash': self.key_hash,
+                    'use_index': self.use_index
+                },
+                f
+            )
+
+    def rebuild_index(self):
+        """
+        Regenerates the index from the directory tree and the segments. Stores that were created without an index start
+        using one
+        """
+        def entries():
+            # Key -> (creation time, subdir) of its most recent entry. The subdir is None if it was removed
+            latest = {}
+
+            for subdir, key in self._walk_keys():
+                # Skip the entries that were not completely saved
+                if not self.serializer.exists(subdir): continue
+                created = os.path.getmtime(os.path.join(subdir, 'key'))
+                if key not in latest or latest[key][0] <= created: latest[key] = created, subdir
+
+            for segment in self._list_segments():
+                for subdir, created, key, _ in packs.iter_records(segment):
+                    if key not in latest or latest[key][0] <= created: latest[key] = created, subdir
+
+            for key, (created, subdir) in latest.iteritems():
+                if subdir is None: continue
+
+                try:
+                    key_dict = Spec.key2dict(key)
+                except ValueError:
+                    warnings.warn('Unable to load spec key: {}'.format(key))
+                    continue
+
+                yield subdir, Spec.dict2digest(key_dict), key_dict, key, created
+
+        index = KeyIndex(self.path)
+        index.rebuild(entries())
+
+        self.index = index
+        if not self.use_index:
+            self.use_index = True
+            self._write_conf()
+
+    def compact_packs(self):
+        """
+        Rewrites the segments that hold removed or replaced entries, keeping only the live ones. No other process should
+        be using the store meanwhile
+
+        :return: The number of bytes reclaimed
+        """
+        if self.index is None: return 0
+
+        # Segment -> ids of its live entries, and the bytes they take
+        live = defaultdict(set)
+        used = defaultdict(int)
+        for subdir, key in self.index.iterkeys():
+            location = packs.parse_id(self.packs_dir, subdir)
+            if location is None: continue
+
+            segment, _, length = location
+            live[segment].add(subdir)
+            used[segment] += packs.record_size(key, length)
+
+        # Start a new segment, the live entries are moved there
+        self._segments.close()
+
+        reclaimed = 0
+        for segment in self._list_segments():
+            size = os.path.getsize(segment)
+            if size == used[segment]: continue
+
+            moves = [
+                (subdir, self._segments.append(key, data))
+                for subdir, _, key, data in packs.iter_records(segment) if subdir in live[segment]
+            ]
+            self.index.move(moves)
+            os.remove(segment)
+            reclaimed += size - used[segment]
+
+        self._segments.close()
+        return reclaimed
+
+    def _list_segments(self):
+        if not os.path.exists(self.packs_dir): return []
+        return sorted(os.path.join(self.packs_dir, fname) for fname in os.listdir(self.packs_dir))
 
     def clean(self, cls=None):
-        for op in self.iterkeys():
-            if cls is None or (cls is not None and isinstance(op, cls)):
+        for op in self.iterkeys(lazy=True):
+            if cls is None or op.isinstance_of(cls):
                 self.remove(op)
 
     def _remove(self, op):
         subdir = self._get_subdir(op)
-        shutil.rmtree(subdir)
+        if self.index is not None: self.index.remove(subdir)
 
-    def iterkeys(self, raw=False):
-        for subdir, _, _ in os.walk(self.path):
-            key_fname = os.path.join(subdir, 'key')
-            if not os.path.exists(key_fname): continue
+        if self._is_packed(subdir):
+            # So that rebuild_index does not bring it back
+            self._segments.append(self.get_key(op), None)
+        else:
+            self._trash(subdir)
 
-            with open(key_fname) as f:
+    def _trash(self, subdir):
+        # Move it out of sight first, so that readers never find it half deleted
+        trash = self._make_tmp_dir()
+        try:
+            os.rename(subdir, trash)
+        except OSError as e:
+            # Somebody else removed it
+            if e.errno != errno.ENOENT: raise
+        shutil.rmtree(trash)
+
+    def _is_packed(self, subdir):
+        return packs.parse_id(self.packs_dir, subdir) is not None
+
+    def _exists(self, subdir):
+        # Packed entries are in the index only once they were completely written
+        return self._is_packed(subdir) or self.serializer.exists(subdir)
+
+    def _load(self, subdir):
+        location = packs.parse_id(self.packs_dir, subdir)
+        if location is None: return self.serializer.load(subdir)
+        return self.serializer.loads(packs.read(*location))
+
+    def iterkeys(self, raw=False, lazy=False):
+        if raw:
+            return ((subdir, Spec.key2dict(key)) for subdir, key in self._iter_keys())
+        elif lazy:
+            return (LazySpec.from_key(key) for _, key in self._iter_keys())
+        else:
+            specs = Spec.dict2spec_many(self._iter_key_dicts(), on_error=self._on_invalid_key)
+            return (spec for spec in specs if spec is not None)
+
+    def _iter_subdirs(self):
+        for subdir, dirnames, fnames in os.walk(self.path):
+            # Skip the entries that are being written
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            # Use the listing os.walk already did instead of a stat per directory
+            if 'key' in fnames: yield subdir
+
+    def _iter_keys(self):
+        if self.index is not None:
+            return self.index.iterkeys()
+        else:
+            return self._walk_keys()
+
+    def _walk_keys(self):
+        for subdir in self._iter_subdirs():
+            with open(os.path.join(subdir, 'key')) as f:
                 key = f.read()
 
-            if raw:
-                yield subdir, Spec.key2dict(key)
-            else:
-                try:
-                    spec = Spec.key2spec(key)
-                except Exception, e:  # there might be a key that is not a valid json
-                    if len(e.args) > 0 and isinstance(e.args[0], basestring) and e.args[0].startswith(
-                            'Unknown spec type'): raise e
-                    traceback.print_exc()
-                    warnings.warn('Unable to load spec key: {}'.format(key))
-                    continue
+            yield subdir, key
 
-                yield spec
+    def _scan_items(self, values):
+        if self.index is not None:
+            return self.index.iterkeys()
+        else:
+            return ((subdir, None) for subdir in self._iter_subdirs())
 
-    def get_id(self, spec):
+    def _scan_key_dict(self, item):
+        subdir, key = item
+        if key is None:
+            try:
+                with open(os.path.join(subdir, 'key')) as f:
+                    key = f.read()
+            except IOError:
+                # Removed after it was listed
+                raise KeyError(subdir)
+
+        try:
+            return Spec.key2dict(key)
+        except ValueError:  # there might be a key that is not a valid json
+            traceback.print_exc()
+            warnings.warn('Unable to load spec key: {}'.format(key))
+            raise KeyError(subdir)
+
+    def _scan_value(self, item):
+        subdir, _ = item
+        if not self._exists(subdir): raise KeyError(subdir)
         try:
-            return self.get_dir_for_saving(spec, create=False)
-        except RuntimeError:
-            raise KeyError(spec)
+            return self._load(subdir)
+        except KeyError as e:
+            # Unpickling corrupt data raises KeyError, which would make scan take the entry as missing
+            raise ValueError("Failed to load {}: {!r}".format(subdir, e))
+
+    def _iter_key_dicts(self):
+        for _, key in self._iter_keys():
+            try:
+                yield Spec.key2dict(key)
+            except ValueError:  # there might be a key that is not a valid json
+                traceback.print_exc()
+                warnings.warn('Unable to load spec key: {}'.format(key))
+
+    def _on_invalid_key(self, spec_dict, e):
+        if len(e.args) > 0 and isinstance(e.args[0], basestring) and e.args[0].startswith('Unknown spec type'):
+            raise e
+        traceback.print_exc()
+        warnings.warn('Unable to load spec key: {}'.format(spec_dict))
+
+    def get_id(self, spec):
+        return self._get_subdir(spec)
 
     def iteritems(self):
         for op in self.iterkeys():
@@ -163,22 +778,16 @@ class FileDataStore(BaseDataStore):
             if isinstance(spec, Spec):
                 type_name = type(spec).__name__
             else:
-                import_path = spec['type']
-                if isinstance(import_path, dict):
-                    type_name = import_path['method']
-                else:
-                    # TODO: this does not belong here
-                    if '@' in import_path:
-                        raise ValueError("Can not handle operations that are methods of non spec classes")
-
-                    type_name = import_path.split(':')[1].split('.')[-1]
+                type_name = LazySpec(spec).type_name
 
             path = os.path.join(self.path, type_name)
         else:
             path = self.path
 
-        key = self.get_key(spec)
-        h = str(mmh3.hash(key))
+        if self.key_hash == 'digest':
+            h = self.get_digest(spec)
+        else:
+            h = str(mmh3.hash(self.get_key(spec)))
 
         if self.split_keys:
             fname = os.path.join(path, h[:3], h[3:6], h[6:])
@@ -187,6 +796,12 @@ class FileDataStore(BaseDataStore):
         return fname
 
     def _get_subdir(self, spec):
+        if self.index is not None:
+            key = self.get_key(spec)
+            for subdir, other_key in self.index.find(self.get_digest(spec)):
+                if other_key == key: return subdir
+            raise KeyError("Spec not found")
+
         dir = self._get_dir(spec)
         if not os.path.exists(dir): raise KeyError("Spec not found")
 
@@ -200,88 +815,208 @@ class FileDataStore(BaseDataStore):
             with open(key_fname) as f:
                 key = f.read()
 
-            if len(key) == 0 and time() - os.path.getctime(key_fname) < 0.1:
-                sleep(0.1)
-                with open(key_fname) as f:
-                    key = f.read()
             if key == self.get_key(spec) and self.serializer.exists(subdir): break
         else:
             raise KeyError("Spec not found")
 
         return subdir
 
+    def get(self, spec, columns=None):
+        """
+        :param columns: Only load these columns. Needs a serializer that supports it, like :py:class:`DataFrameSerializer`.
+        Such partial loads skip the get cache
+        """
+        if columns is None: return super(FileDataStore, self).get(spec)
+
+        if not getattr(self.serializer, 'supports_columns', False):
+            raise ValueError("{} can not load a subset of columns".format(type(self.serializer).__name__))
+
+        if isinstance(spec, LazySpec): spec = spec.to_dict()
+        subdir = spec if isinstance(spec, basestring) else self._get_subdir(spec)
+        if self._is_packed(subdir): raise ValueError("Packed entries can not load a subset of columns")
+        return self.serializer.load(subdir, columns=columns)
+
     def _get(self, spec):
         if isinstance(spec, basestring):
             # assume that spec is the output of self.get_id
             subdir = spec
             assert subdir.startswith(self.path)
-            return self.serializer.load(subdir)
+            return self._load(subdir)
         else:
             subdir = self._get_subdir(spec)
             try:
-                return self.serializer.load(subdir)
+                return self._load(subdir)
+            except Exception:
+                if self._is_packed(subdir) or os.path.exists(subdir):
+                    traceback.print_exc()
+                    raise KeyError('Failed to load spec')
+
+            # The subdir is gone. Either a writer replaced the entry after it was looked up, or it was removed
+            # without going through the index (e.g. by hand)
+            new_subdir = self._get_subdir(spec)
+            if new_subdir == subdir:
+                if self.index is not None: self.index.remove(subdir)
+                raise KeyError('Spec not found')
+
+            try:
+                return self._load(new_subdir)
             except Exception:
                 traceback.print_exc()
                 raise KeyError('Failed to load spec')
 
     def get_dir_for_saving(self, spec, create=True):
-        dir = self._get_dir(spec)
-        if not os.path.exists(dir):
-            if create:
-                os.makedirs(dir)
-            else:
-                raise RuntimeError()
+        """
+        :return: The subdir of the entry of `spec`. If there is none and `create` is set, a new empty subdir is
+        allocated for it. Replace its files instead of writing them in place, they might be shared with the entries
+        created by `copy_value`
+        """
+        try:
+            return self._get_subdir(spec)
+        except KeyError:
+            if not create: raise
+            return self._claim_subdir(self._get_dir(spec))
 
-        for subdir in os.listdir(dir):
-            subdir = os.path.join(dir, subdir)
-            key_fname = os.path.join(subdir, 'key')
-            if not os.path.exists(key_fname): continue
-            with open(key_fname) as f:
-                key = f.read()
-            if key == spec.key:
-                return subdir
-        else:
-            while True:
-                subdirs = map(int, os.listdir(dir))
-                if len(subdirs) == 0 and create:
-                    subdir = '0'
-                elif not create:
-                    raise KeyError()
-                else:
-                    subdir = str(max(subdirs) + 1)
-
-                subdir = os.path.join(dir, subdir)
-                if create:
-                    try:
-                        os.makedirs(subdir)
-                    except OSError:
-                        pass
+    def _claim_subdir(self, dir):
+        """
+        Creates the next numbered subdir of `dir`. os.mkdir fails if the subdir exists, so concurrent writers never get
+        the same one
+        """
+        _makedirs(dir)
+        while True:
+            taken = [int(name) for name in os.listdir(dir) if name.isdigit()]
+            subdir = os.path.join(dir, str(max(taken) + 1 if taken else 0))
+            try:
+                os.mkdir(subdir)
                 return subdir
+            except OSError as e:
+                if e.errno != errno.EEXIST: raise
+
+    def _make_tmp_dir(self):
+        """
+        Creates a directory where an entry can be written before publishing it. It is in the same file system as the
+        entries, so that they can be moved with a rename
+        """
+        tmp_root = os.path.join(self.path, '.tmp')
+        _makedirs(tmp_root)
+
+        res = os.path.join(tmp_root, '{}-{}'.format(os.getpid(), uuid.uuid4().hex))
+        os.mkdir(res)
+        return res
 
     def save(self, spec, obj):
         if isinstance(spec, basestring):
-            assert spec.startswith(self.path + '/') # security check ;)
-            subdir = spec
-        else:
-            subdir = self.get_dir_for_saving(spec)
+            # assume that spec is the output of self.get_id
+            assert spec.startswith(self.path + '/')  # security check ;)
+            # The entry is saved again under its key, the same way as a spec is
+            spec = Spec.key2dict(self._read_key(spec))
 
-        key_fname = os.path.join(subdir, 'key')
+        if self.pack_threshold is not None:
+            data = self.serializer.dumps(obj)
+            if data is not None and len(data) < self.pack_threshold:
+                self._save_packed(spec, data)
+                return
+
+        tmp_dir = self._make_tmp_dir()
+        try:
+            self.serializer.save(obj, tmp_dir)
+            self._publish(tmp_dir, spec)
+        finally:
+            if os.path.exists(tmp_dir): shutil.rmtree(tmp_dir)
+
+    def copy_value(self, spec, new_spec, source=None):
+        """
+        The files of the entry are hard linked instead of copied, so the value is neither loaded nor written again, and
+        the file system counts the entries that use each file. It falls back to loading and saving the value if the
+        serializers differ, and to copying the files if they can not be linked (e.g. `source` is in another file system).
+
+        Files of linked entries are shared, so they must not be modified in place (see `get_dir_for_saving`)
+        """
+        source = self if source is None else source
+        if not self._copies_without_loading(source):
+            return super(FileDataStore, self).copy_value(spec, new_spec, source=source)
+
+        if isinstance(spec, LazySpec): spec = spec.to_dict()
+        subdir = source._get_subdir(spec)
+        if source._is_packed(subdir):
+            # Packed values are small, it is cheaper to write them again
+            self.save(new_spec, source._load(subdir))
+            return
+
+        tmp_dir = self._make_tmp_dir()
         try:
-            with open(key_fname, 'w') as f:
-                f.write(self.get_key(spec))
+            for fname in os.listdir(subdir):
+                if fname != 'key': _link(os.path.join(subdir, fname), os.path.join(tmp_dir, fname))
+            self._publish(tmp_dir, new_spec)
+        finally:
+            if os.path.exists(tmp_dir): shutil.rmtree(tmp_dir)
 
-            self.serializer.save(obj, subdir)
-        except Exception, e:
-            # clean up the mess to mantain the invariatn
-            if os.path.exists(key_fname): os.unlink(key_fname)
-            if os.path.exists(subdir): shutil.rmtree(subdir)
+    def _copies_without_loading(self, source):
+        return isinstance(source, FileDataStore) and source.serializer == self.serializer
+
+    def _read_key(self, subdir):
+        if self._is_packed(subdir): return self.index.get_key(subdir)
+        try:
+            with open(os.path.join(subdir, 'key')) as f:
+                return f.read()
+        except IOError:
+            raise KeyError(subdir)
+
+    def _publish(self, tmp_dir, spec):
+        """
+        Makes the value written in `tmp_dir` the entry of `spec`. It is renamed onto a new subdir, so that readers find
+        either the whole previous entry or the whole new one, and the previous entry is removed afterwards.
+
+        If several writers publish the same spec at once, only one of them keeps its entry
+        """
+        key = self.get_key(spec)
+        with open(os.path.join(tmp_dir, 'key'), 'w') as f:
+            f.write(key)
+
+        dir = self._get_dir(spec)
+        if self.index is None:
+            # The directory tree is all there is, writers of the same spec take turns
+            with _locked(dir):
+                old_subdir = self._get_subdir_or_none(spec)
+                subdir = self._claim_subdir(dir)
+                os.rename(tmp_dir, subdir)
+                if old_subdir is not None: self._trash(old_subdir)
+            return
+
+        old_subdir = self._get_subdir_or_none(spec)
+        subdir = self._claim_subdir(dir)
+        os.rename(tmp_dir, subdir)
+
+        key_dict = spec if isinstance(spec, dict) else spec.to_dict()
+        if self.index.add(subdir, self.get_digest(spec), key_dict, key, replaces=old_subdir):
+            # The space of a replaced packed entry is reclaimed by compact_packs
+            if old_subdir is not None and not self._is_packed(old_subdir): self._trash(old_subdir)
+        else:
+            # Another writer published it meanwhile
+            self._trash(subdir)
+
+    def _save_packed(self, spec, data):
+        key = self.get_key(spec)
+        subdir = self._segments.append(key, data)
+        old_subdir = self._get_subdir_or_none(spec)
+
+        key_dict = spec if isinstance(spec, dict) else spec.to_dict()
+        # If another writer published it meanwhile, the record is left for compact_packs to reclaim
+        added = self.index.add(subdir, self.get_digest(spec), key_dict, key, replaces=old_subdir)
+        if added and old_subdir is not None and not self._is_packed(old_subdir): self._trash(old_subdir)
+
+    def _get_subdir_or_none(self, spec):
+        try:
+            return self._get_subdir(spec)
+        except KeyError:
+            return None
 
     def __contains__(self, spec):
+        if isinstance(spec, LazySpec): spec = spec.to_dict()
         try:
             subdir = self._get_subdir(spec)
-            return self.serializer.exists(subdir)
+            return self._exists(subdir)
         except KeyError:
-            if config.interactive_rehash and spec not in RehashUI.ignored_specs:
+            if config.interactive_rehash and spec not in get_rehash_ui().ignored_specs:
                 self.interactive_rehash(spec)
                 return spec in self
             else:
@@ -293,3 +1028,34 @@ class FileDataStore(BaseDataStore):
             return False
         except:
             return True
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        # Another process might have created it
+        if e.errno != errno.EEXIST: raise
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        # Either they are in different file systems, or the file system does not support hard links
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP): raise
+        shutil.copy2(src, dst)
+
+
+@contextmanager
+def _locked(dir):
+    """
+    Holds an exclusive lock on `dir` among processes, it is released if the process dies
+    """
+    _makedirs(dir)
+    with open(os.path.join(dir, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,197 @@
+"""
+Persistent index of the entries of a :py:class:`FileDataStore`. It maps the digest of each key to the subdir holding it,
+along with the key itself, so that neither looking up a spec nor listing the keys has to walk the directory tree and
+read the key files.
+
+It is an sqlite3 database in the root of the store. Packed entries (see fito.data_store.packs) are only reachable
+through it. To build it for a store that does not have one, or to regenerate it from the directory tree and the
+segments:
+
+    python -m fito.data_store.file_index <store path> [--import module ...]
+
+To reclaim the space of the packed entries that were removed or replaced:
+
+    python -m fito.data_store.file_index <store path> --compact
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class KeyIndex(object):
+    # How many rows are fetched by each query while iterating, so that no read transaction is held during a scan
+    page_size = 1000
+
+    def __init__(self, path, fname='index.sqlite'):
+        """
+        :param path: The root of the data store. Subdirs are stored relative to it, so the store can be moved
+        """
+        self.path = path
+        self.fname = os.path.join(path, fname)
+        self._local = threading.local()
+
+    def __reduce__(self):
+        # Connections are not picklable, the copy opens its own ones
+        return KeyIndex, (self.path, os.path.relpath(self.fname, self.path))
+
+    @property
+    def conn(self):
+        # sqlite3 connections can not be shared among threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or not os.path.exists(self.fname):
+            # Either it is the first use in this thread, or the directory of the store was removed (and maybe
+            # created again) from under us
+            if not os.path.exists(self.path): os.makedirs(self.path)
+            conn = self._local.conn = sqlite3.connect(self.fname, timeout=60)
+            # Keys are compared with the ones built by Spec, which are str
+            conn.text_factory = str
+            # Do not wait for each write to reach the disk. The directory tree and the segments are the source of
+            # truth, if the index gets corrupted by a crash it can be rebuilt from them
+            conn.execute('PRAGMA synchronous = OFF')
+
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS entries ('
+                    'subdir TEXT PRIMARY KEY, digest TEXT NOT NULL, type TEXT, key TEXT NOT NULL, created REAL)'
+                )
+
+            # Each key has at most one entry. It also serves the lookups by digest
+            try:
+                with conn:
+                    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS entries_key ON entries (digest, key)')
+            except sqlite3.IntegrityError:
+                # Older versions could index two entries for a key, keep the last one
+                with conn:
+                    conn.execute(
+                        'DELETE FROM entries WHERE rowid NOT IN (SELECT MAX(rowid) FROM entries GROUP BY digest, key)'
+                    )
+                    conn.execute('CREATE UNIQUE INDEX entries_key ON entries (digest, key)')
+        return conn
+
+    def add(self, subdir, digest, key_dict, key, replaces=None):
+        """
+        :param replaces: Subdir of an entry that is removed in the same transaction, so that readers find either of them
+        :return: Whether it was added. It is not if the key got another entry meanwhile (e.g. another process saved the
+        same spec), in which case the index is left as it was
+        """
+        try:
+            with self.conn:
+                if replaces is not None:
+                    self.conn.execute('DELETE FROM entries WHERE subdir = ?', (self._relpath(replaces),))
+                self.conn.execute(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                    (self._relpath(subdir), digest, get_type(key_dict), key, time.time())
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def remove(self, subdir):
+        with self.conn:
+            self.conn.execute('DELETE FROM entries WHERE subdir = ?', (self._relpath(subdir),))
+
+    def move(self, moves):
+        """
+        Changes the subdirs of many entries in a single transaction
+
+        :param moves: Iterable of (old subdir, new subdir)
+        """
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE entries SET subdir = ? WHERE subdir = ?',
+                ((self._relpath(new), self._relpath(old)) for old, new in moves)
+            )
+
+    def get_key(self, subdir):
+        row = self.conn.execute('SELECT key FROM entries WHERE subdir = ?', (self._relpath(subdir),)).fetchone()
+        if row is None: raise KeyError(subdir)
+        return row[0]
+
+    def find(self, digest):
+        """
+        :return: List of (subdir, key) pairs whose key has that digest
+        """
+        rows = self.conn.execute('SELECT subdir, key FROM entries WHERE digest = ?', (digest,)).fetchall()
+        return [(os.path.join(self.path, subdir), key) for subdir, key in rows]
+
+    def iterkeys(self):
+        """
+        :return: Iterator of (subdir, key) pairs
+        """
+        last_rowid = -1
+        while True:
+            rows = self.conn.execute(
+                'SELECT rowid, subdir, key FROM entries WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                (last_rowid, self.page_size)
+            ).fetchall()
+            if not rows: return
+
+            for _, subdir, key in rows:
+                yield os.path.join(self.path, subdir), key
+            last_rowid = rows[-1][0]
+
+    def rebuild(self, entries):
+        """
+        Replaces the contents of the index in a single transaction
+
+        :param entries: Iterable of (subdir, digest, key dict, key, creation time)
+        """
+        with self.conn:
+            self.conn.execute('DELETE FROM entries')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                (
+                    (self._relpath(subdir), digest, get_type(key_dict), key, created)
+                    for subdir, digest, key_dict, key, created in entries
+                )
+            )
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def _relpath(self, subdir):
+        return os.path.relpath(subdir, self.path)
+
+
+def get_type(key_dict):
+    spec_type = key_dict.get('type')
+    return spec_type if isinstance(spec_type, basestring) else json.dumps(spec_type, sort_keys=True)
+
+
+def main():
+    import argparse
+    import importlib
+
+    parser = argparse.ArgumentParser(
+        description='Rebuilds the key index of a FileDataStore from its directory tree and segments'
+    )
+    parser.add_argument('path')
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='Reclaim the space of the removed packed entries instead. No other process should be using the store'
+    )
+    parser.add_argument(
+        '--import', dest='modules', nargs='*', default=[],
+        help='Modules defining the specs that use merkle keys, their digests can not be computed otherwise'
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.path, 'conf.yaml')):
+        parser.error('{} is not a data store'.format(args.path))
+
+    for module in args.modules: importlib.import_module(module)
+
+    from fito.data_store.file import FileDataStore
+    data_store = FileDataStore(args.path)
+    if args.compact:
+        if data_store.index is None: parser.error('{} has no index, so it has no packed entries'.format(args.path))
+        print '{} bytes reclaimed'.format(data_store.compact_packs())
+    else:
+        data_store.rebuild_index()
+        print '{} entries indexed'.format(len(data_store.index))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 import mmh3
+import sys
 import warnings
+from itertools import tee, izip
 from random import random
 
 import pymongo
@@ -7,8 +9,11 @@ from bson import ObjectId
 from fito import PrimitiveField
 from fito import SpecField
 from fito.data_store.base import BaseDataStore
+from fito.lazy_module import make_lazy
+from fito.specs.lazy import LazySpec
 from fito import Spec
 from gridfs import GridFS
+from memoized_property import memoized_property
 from pymongo.collection import Collection
 from pymongo.errors import DuplicateKeyError
 from pymongo.mongo_client import MongoClient
@@ -20,7 +25,21 @@ def get_collection(client, name):
     return client[db][coll]
 
 
-global_client = MongoClient()
+_global_client = None
+
+
+def get_global_client():
+    """
+    The client used when a MongoHashMap is instanced with the name of a collection. It is created on first use, it can
+    also be accessed as `global_client`
+    """
+    # Assigning `fito.data_store.mongo.global_client` sets it on the lazy module that replaced this one
+    client = sys.modules[__name__].__dict__.get('global_client')
+    if client is not None: return client
+
+    global _global_client
+    if _global_client is None: _global_client = MongoClient()
+    return _global_client
 
 
 class MongoHashMap(BaseDataStore):
@@ -35,7 +54,7 @@ class MongoHashMap(BaseDataStore):
         super(MongoHashMap, self).__init__(*args, **kwargs)
 
         if isinstance(self.coll, basestring):
-            self.coll = get_collection(global_client, self.coll)
+            self.coll = get_collection(get_global_client(), self.coll)
         else:
             assert isinstance(self.coll, Collection)
 
@@ -66,21 +85,36 @@ class MongoHashMap(BaseDataStore):
         if doc is None:
             self.coll.conf.insert({'key': 'id_seq', 'value': 0})
 
+    @memoized_property
+    def key_hash(self):
+        """
+        How the op_hash of the documents is computed. Collections created before digests were introduced
+        use 'mmh3' over the whole key, the new ones use the spec digest
+        """
+        doc = self.coll.conf.find_one({'key': 'key_hash'})
+        if doc is not None: return doc['value']
+
+        res = 'mmh3' if self.coll.find_one(projection=[]) is not None else 'digest'
+        self.coll.conf.insert({'key': 'key_hash', 'value': res})
+        return res
+
     def clean(self):
         self.coll.drop()
         self.coll.conf.drop()
         self.coll.fs.files.drop()
         self.coll.fs.chunks.drop()
+        if hasattr(self, '_key_hash'): del self._key_hash
         if self.add_incremental_id: self._init_incremental_id()
 
     def create_indices(self):
         self.coll.create_index('op_hash')
         self.coll.create_index('rnd')
 
-    @classmethod
-    def _get_op_hash(cls, spec):
-        op_hash = mmh3.hash(cls.get_key(spec))
-        return op_hash
+    def _get_op_hash(self, spec):
+        if self.key_hash == 'digest':
+            return self.get_digest(spec)
+        else:
+            return mmh3.hash(self.get_key(spec))
 
     def _build_doc(self, spec, value):
         if isinstance(spec, ObjectId):
@@ -125,27 +159,43 @@ class MongoHashMap(BaseDataStore):
                 self._insert(docs)
 
     def _parse_doc(self, doc):
+        spec = Spec.dict2spec(doc['spec'])
+        return spec, self._parse_values(doc)
+
+    def _parse_values(self, doc):
         values = doc['values']
         if self.use_gridfs:
             values = self.gridfs.get(values).read()
-        spec = Spec.dict2spec(doc['spec'])
-        return spec, values
+        return values
 
     def _dict2spec(self, d):
         d = d.copy()
         return Spec.dict2spec(d)
 
-    def iterkeys(self, raw=False):
-        for doc in self.coll.find(no_cursor_timeout=False, projection=['spec']):
-            if raw:
-                yield doc['_id'], doc['spec']
-            else:
-                yield Spec.dict2spec(doc['spec'])
+    def iterkeys(self, raw=False, lazy=False):
+        docs = self.coll.find(no_cursor_timeout=False, projection=['spec'])
+        if raw:
+            return ((doc['_id'], doc['spec']) for doc in docs)
+        elif lazy:
+            return (LazySpec(doc['spec']) for doc in docs)
+        else:
+            return Spec.dict2spec_many(doc['spec'] for doc in docs)
 
     def iteritems(self):
-        for doc in self.coll.find(no_cursor_timeout=False):
-            spec, serie = self._parse_doc(doc)
-            yield self._dict2spec(doc['spec']), serie
+        # dict2spec_many reads ahead at most one batch, so does the tee
+        spec_docs, value_docs = tee(self.coll.find(no_cursor_timeout=False))
+        specs = Spec.dict2spec_many(doc['spec'] for doc in spec_docs)
+        for spec, doc in izip(specs, value_docs):
+            yield spec, self._parse_values(doc)
+
+    def _scan_items(self, values):
+        return self.coll.find(no_cursor_timeout=False, projection=None if values else ['spec'])
+
+    def _scan_key_dict(self, doc):
+        return doc['spec']
+
+    def _scan_value(self, doc):
+        return self._parse_values(doc)
 
     def _get_doc(self, spec, projection=None):
         if projection is not None and 'spec' not in projection:
@@ -168,7 +218,7 @@ class MongoHashMap(BaseDataStore):
 
     def _get(self, spec):
         doc = self._get_doc(spec)
-        return self._parse_doc(doc)[1]
+        return self._parse_values(doc)
 
     def get_id(self, spec):
         return self._get_doc(spec, projection=[])['_id']
@@ -215,3 +265,6 @@ class MongoHashMap(BaseDataStore):
         if len(res) == 1:
             res = res[0]
         return res
+
+
+make_lazy(__name__, global_client=get_global_client)
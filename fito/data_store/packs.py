@@ -0,0 +1,136 @@
+"""
+Segment files where :py:class:`FileDataStore` packs its small entries, instead of giving each one a subdir with a key
+file and a value file.
+
+Each process appends to its own segments, so writers do not need locks. A record holds a header (creation time, key
+length and value length), the key and the serialized value. Removing an entry appends a tombstone, a record without a
+value, so that the index can be rebuilt from the segments. The space of the removed and replaced entries is reclaimed
+by :py:meth:`FileDataStore.compact_packs`.
+
+The id of a packed entry (what :py:meth:`FileDataStore.get_id` returns) is `<packs dir>/<segment>@<offset>+<length>`
+"""
+import os
+import struct
+import threading
+import time
+import uuid
+
+_header = struct.Struct('<dII')
+# Value length of the tombstones
+_tombstone = 0xffffffff
+
+
+class SegmentWriter(object):
+    def __init__(self, dir, max_size=64 * 2 ** 20):
+        """
+        :param dir: Where the segments are
+        :param max_size: A new segment is started once the current one has this many bytes
+        """
+        self.dir = dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = None
+        self._pid = None
+
+    @property
+    def current_segment(self):
+        """
+        Name of the segment this process is appending to, if any
+        """
+        if self._file is None or self._pid != os.getpid(): return None
+        return os.path.basename(self._file.name)
+
+    def append(self, key, data):
+        """
+        :param data: The serialized value, None for a tombstone
+        :return: The id of the record
+        """
+        header = _header.pack(time.time(), len(key), _tombstone if data is None else len(data))
+        with self._lock:
+            f = self._get_file()
+            offset = self._size + _header.size + len(key)
+            f.write(header)
+            f.write(key)
+            if data is not None: f.write(data)
+            # Other processes read it as soon as the index points to it
+            f.flush()
+
+            self._size = offset + (0 if data is None else len(data))
+            return get_id(self.dir, os.path.basename(f.name), offset, 0 if data is None else len(data))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid(): self._file.close()
+            self._file = None
+
+    def _get_file(self):
+        # A forked process must not append to the segment of its parent
+        if self._file is not None and (self._pid != os.getpid() or self._size >= self.max_size):
+            if self._pid == os.getpid(): self._file.close()
+            self._file = None
+
+        if self._file is None:
+            try:
+                os.makedirs(self.dir)
+            except OSError:
+                if not os.path.isdir(self.dir): raise
+
+            fname = os.path.join(self.dir, 'segment-{}-{}.pack'.format(os.getpid(), uuid.uuid4().hex))
+            self._file = open(fname, 'ab')
+            self._size = 0
+            self._pid = os.getpid()
+
+        return self._file
+
+
+def get_id(dir, segment, offset, length):
+    return os.path.join(dir, '{}@{}+{}'.format(segment, offset, length))
+
+
+def parse_id(dir, id):
+    """
+    :return: (segment path, offset, length) if `id` is the id of a packed entry, otherwise None
+    """
+    if not id.startswith(dir + os.sep): return None
+    segment, location = id.rsplit('@', 1)
+    offset, length = location.split('+')
+    return segment, int(offset), int(length)
+
+
+def read(segment, offset, length):
+    with open(segment, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def iter_records(segment):
+    """
+    :return: Iterator of (id, creation time, key, value), the value is None for tombstones. A record that was not
+    completely written ends the iteration
+    """
+    dir, name = os.path.split(segment)
+    with open(segment, 'rb') as f:
+        while True:
+            header = f.read(_header.size)
+            if len(header) < _header.size: return
+
+            created, key_length, length = _header.unpack(header)
+            key = f.read(key_length)
+            if len(key) < key_length: return
+
+            if length == _tombstone:
+                yield None, created, key, None
+                continue
+
+            offset = f.tell()
+            data = f.read(length)
+            if len(data) < length: return
+            yield get_id(dir, name, offset, length), created, key, data
+
+
+def record_size(key, length):
+    """
+    Bytes taken by a record in its segment
+    """
+    return _header.size + len(key) + length
@@ -81,7 +81,7 @@ class RehashUI(Cmd):
             target_spec
         )
 
-        self.data_store[self.spec] = self.data_store[target_spec]
+        self.data_store.copy_value(target_spec, self.spec)
         if action == 'move':
             self.data_store.remove(target_spec)
 
@@ -0,0 +1,38 @@
+"""
+Deferred module attributes, so that importing fito does not pay for optional subsystems (e.g. pymongo)
+"""
+import sys
+from types import ModuleType
+
+
+class LazyModule(ModuleType):
+    """
+    Module whose attributes in `_lazy_factories` are built on first access, like a module level __getattr__ would
+    """
+
+    def __getattr__(self, name):
+        factories = self.__dict__.get('_lazy_factories', {})
+        if name not in factories:
+            raise AttributeError("'module' object has no attribute '{}'".format(name))
+
+        value = factories[name]()
+        setattr(self, name, value)
+        return value
+
+
+def make_lazy(module_name, **factories):
+    """
+    Replaces a module by a :py:class:`LazyModule` with the same contents. Meant to be called at the end of the module.
+
+    >>> make_lazy(__name__, global_client=lambda: MongoClient())
+
+    :param factories: Maps attribute names to the functions that build them
+    """
+    module = sys.modules[module_name]
+    res = LazyModule(module_name, module.__doc__)
+    res.__dict__.update(module.__dict__)
+    res._lazy_factories = factories
+    # Keep the original module alive, otherwise python clears its globals, which the functions it defines still use
+    res._original_module = module
+    sys.modules[module_name] = res
+    return res
@@ -1,5 +1,3 @@
-import traceback
-import warnings
 from collections import defaultdict
 from itertools import product
 
@@ -7,12 +5,6 @@ from fito import Operation
 from fito.specs.base import Spec
 from fito.specs.fields import PrimitiveField, _no_default, BaseSpecField
 
-try:
-    from sklearn.model_selection import ParameterGrid
-except ImportError:
-    traceback.print_exc()
-    warnings.warn('Could not import ParameterGrid, without it the model selection module can not be used')
-
 
 class ModelParameter(PrimitiveField):
     def __init__(self, pos=None, default=_no_default, serialize=True, grid=None, *args, **kwargs):
@@ -38,6 +30,9 @@ def ModelField(pos=None, default=_no_default, base_type=None, serialize=True, gr
 class Model(Operation):
     @classmethod
     def get_primitive_param_grid(cls):
+        # scikit-learn takes a while to import, and it is only needed here
+        from sklearn.model_selection import ParameterGrid
+
         res = {}
         for field_name, field_spec in cls.get_fields():
             if isinstance(field_spec, ModelParameter):
@@ -54,7 +49,7 @@ class Model(Operation):
             for impl in field_spec.grid:
                 submodels_params[field_name].extend(impl.get_hyper_parameters_grid())
 
-        res = []
+        rows = []
 
         if len(submodels_params) > 0:
             submodel_fields, submodels_params = zip(*submodels_params.iteritems())
@@ -65,14 +60,10 @@ class Model(Operation):
                 # If there are submodels, let's combine them
                 for params in product(*submodels_params):
                     params = map(Spec.dict2spec, params)
-                    model_fields_combination.update(dict(zip(submodel_fields, params)))
-
-                    res.append(
-                        cls(**model_fields_combination).to_dict()
-                    )
+                    row = dict(model_fields_combination)
+                    row.update(zip(submodel_fields, params))
+                    rows.append(row)
             else:
-                res.append(
-                    cls(**model_fields_combination).to_dict()
-                )
+                rows.append(model_fields_combination)
 
-        return res
+        return [model.to_dict() for model in cls.from_records(rows)]
@@ -105,9 +105,9 @@ class FifoCache(object):
 
     def _get_key(self, spec_or_dict):
         if isinstance(spec_or_dict, Spec):
-            return spec_or_dict.key
+            return spec_or_dict.digest
         elif isinstance(spec_or_dict, dict):
-            return Spec._dict2key(spec_or_dict)
+            return Spec.dict2digest(spec_or_dict)
         else:
             # assume it's an id
             return spec_or_dict
@@ -1,77 +1,58 @@
 import ctypes
+import hashlib
 import inspect
-import json
 import os
+import sys
+import threading
 import traceback
 import warnings
 from collections import OrderedDict
-from functools import partial
+from weakref import WeakKeyDictionary, WeakValueDictionary, ref as weak_ref
 from functools import total_ordering
-from itertools import chain
+from itertools import chain, izip, repeat
 
 from fito.specs.fields import KwargsField, ArgsField, Field, BaseSpecField, SpecCollection, UnboundField, \
-    PrimitiveField
-from fito.specs.utils import recursive_map, is_iterable, matching_fields
+    PrimitiveField, FieldSchema, FieldSlot
+from fito.specs import json_codec
+from fito.specs.codec import SpecCodec
+from fito.specs.utils import matching_fields
 from memoized_property import memoized_property
 
-try:
-    from bson import json_util
-    from bson import json_util
-    from json import dumps, dump, load, loads
-
-
-    def json_dumps(*args, **kwargs):
-        kwargs['default'] = json_util.default
-        return dumps(*args, **kwargs)
-
-
-    def json_dump(*args, **kwargs):
-        kwargs['default'] = json_util.default
-        return dump(*args, **kwargs)
-
-
-    def set_default_json_options():
-        # how should we handle datetimes? This forces non timezone aware datetimes
-        # TODO: Either throw exception when a tz aware datetime is received, or handle both correctly
-        res = json_util.DEFAULT_JSON_OPTIONS = json_util.JSONOptions(tz_aware=False)
-        return res
-
-
-    def json_loads(*args, **kwargs):
-        kwargs['object_hook'] = partial(json_util.object_hook, json_options=set_default_json_options())
-        return loads(*args, **kwargs)
 
+class WeirdModulePathException(Exception): pass
 
-    def json_load(*args, **kwargs):
-        kwargs['object_hook'] = partial(json_util.object_hook, json_options=set_default_json_options())
-        return load(*args, **kwargs)
 
+class InvalidSpecInstance(Exception):
+    pass
 
-    json.dump = json_dump
-    json.dumps = json_dumps
-    json.load = json_load
-    json.loads = json_loads
 
-except ImportError:
-    warnings.warn("Couldn't import json_util from bson, won't be able to handle datetime")
+class MainModuleWarning(UserWarning): pass
 
-try:
-    import yaml
-except ImportError:
-    warnings.warn("Couldn't yaml, some features won't be enabled")
 
+warnings.filterwarnings('once', '.*', MainModuleWarning, __name__)
 
-class WeirdModulePathException(Exception): pass
+# Holds the spec whose merkle key is being computed, see Spec._merkle_dict
+_key_encoding = threading.local()
 
 
-class InvalidSpecInstance(Exception):
-    pass
+def key_digest(key):
+    """
+    Fixed size (128 bits) hex digest of a spec key
+    """
+    if isinstance(key, unicode): key = key.encode('utf-8')
+    return hashlib.md5(key).hexdigest()
 
 
-class MainModuleWarning(UserWarning): pass
+# Registries of the Spec subclasses, by class name and by import path. They are updated by SpecMeta and used by
+# Spec.type2spec_class. Weak references avoid keeping dynamically created classes alive
+_spec_classes_by_name = WeakValueDictionary()
+_spec_classes_by_path = WeakValueDictionary()
 
+# Canonical instance of each interned spec, by its class and the key of all of its values. See Spec.interned
+_interned_specs = WeakValueDictionary()
 
-warnings.filterwarnings('once', '.*', MainModuleWarning, __name__)
+# Attributes where specs memoize their keys, they are dropped whenever a field changes
+_cached_keys = ('_key', '_digest', '_serialized_key')
 
 
 class SpecMeta(type):
@@ -83,7 +64,45 @@ class SpecMeta(type):
 
         :return: New Spec subclass
         """
+        frozen_base = any(getattr(base, 'frozen', False) for base in bases)
+        frozen = dct.get('frozen', frozen_base)
+        if frozen_base and not frozen:
+            raise ValueError("Class %s can not unfreeze a frozen spec" % name)
+
+        interned_base = any(getattr(base, 'interned', False) for base in bases)
+        interned = dct.get('interned', interned_base)
+        if interned_base and not interned:
+            raise ValueError("Class %s can not stop interning an interned spec" % name)
+
+        if interned and not frozen:
+            raise ValueError("Class %s can not be interned without being frozen" % name)
+
+        # Interning happens when the class is called, only interned classes pay for it
+        if interned: cls = InternedSpecMeta
+
+        if frozen and '__slots__' not in dct:
+            # Only the first frozen class of the hierarchy adds the slots
+            has_slots = any(hasattr(base, '_values') for base in bases)
+            dct['__slots__'] = () if has_slots else ('_values',) + _cached_keys
+
         res = type.__new__(cls, name, bases, dct)
+        type.__setattr__(res, '_schema', FieldSchema.from_class(res))
+
+        if frozen:
+            # The field values live in the `_values` tuple, in the order of the schema
+            for i, (attr, attr_type) in enumerate(res._schema.fields):
+                type.__setattr__(res, attr, FieldSlot(i, attr_type))
+            type.__setattr__(res, '_field_index', {attr: i for i, (attr, _) in enumerate(res._schema.fields)})
+
+        # Whether Spec.__setattr__ is the only override of __setattr__, in which case initialize can write the
+        # values straight into __dict__
+        spec_class = globals().get('Spec', res)
+        type.__setattr__(res, '_plain_setattr', all(
+            klass is spec_class or klass is object
+            for klass in res.__mro__
+            if '__setattr__' in klass.__dict__
+        ))
+
         if res.__doc__ is None:
             res.__doc__ = res.get_default_doc_string()
 
@@ -96,8 +115,67 @@ class SpecMeta(type):
         check_fields(dict(res.get_bound_fields()), name)
         check_fields(dict(res.get_unbound_fields()), name)
 
+        res._register()
         return res
 
+    def __setattr__(cls, name, value):
+        if name == '__module__' or name == '__name__':
+            # The import path is about to change
+            cls._unregister()
+            _import_path_cache.pop(cls, None)
+            type.__setattr__(cls, name, value)
+            cls._register()
+            return
+
+        type.__setattr__(cls, name, value)
+        if isinstance(value, Field) or name in cls._schema.by_name:
+            cls._rebuild_schema()
+
+    def _import_path(cls):
+        return '{}:{}'.format(cls.__module__, cls.__name__)
+
+    def _register(cls):
+        """
+        Registers the class. If another class was registered with the same name or path (e.g. the class was redefined
+        or its module reloaded), the new one replaces it
+        """
+        _spec_classes_by_name[cls.__name__] = cls
+        _spec_classes_by_path[cls._import_path()] = cls
+
+    def _unregister(cls):
+        if _spec_classes_by_name.get(cls.__name__) is cls:
+            del _spec_classes_by_name[cls.__name__]
+
+        if _spec_classes_by_path.get(cls._import_path()) is cls:
+            del _spec_classes_by_path[cls._import_path()]
+
+    def __delattr__(cls, name):
+        type.__delattr__(cls, name)
+        if name in cls._schema.by_name:
+            cls._rebuild_schema()
+
+    def _rebuild_schema(cls):
+        """
+        Rebuilds the field schema of this class and all its subclasses.
+        Only happens when a field is set or deleted after the class was created (e.g. by operation_from_func)
+        """
+        queue = [cls]
+        while len(queue) > 0:
+            klass = queue.pop()
+            if klass.frozen:
+                raise RuntimeError("Can not change the fields of {}, it is frozen".format(klass.__name__))
+            type.__setattr__(klass, '_schema', FieldSchema.from_class(klass))
+            queue.extend(klass.__subclasses__())
+
+
+class InternedSpecMeta(SpecMeta):
+    """
+    Metaclass of the interned Spec subclasses, see Spec.interned
+    """
+
+    def __call__(cls, *args, **kwargs):
+        return type.__call__(cls, *args, **kwargs)._intern()
+
 
 def check_fields(fields, class_name):
     fields_pos = sorted([attr_type.pos for attr_name, attr_type in fields.iteritems() if attr_type.pos is not None])
@@ -150,6 +228,19 @@ class Spec(object):
     """
     __metaclass__ = SpecMeta
 
+    # When True, the key is built from the primitive fields plus the digests of the (memoized) keys of the sub specs,
+    # instead of serializing the whole tree. Such a key can not be parsed back, use serialized_key for that
+    merkle_keys = False
+
+    # When True, instances are immutable once created and keep their field values in a tuple instead of a __dict__,
+    # which makes them much smaller. Frozen specs are shared instead of copied
+    frozen = False
+
+    # When True, building a spec with the same values as a live one (including the fields that are not serialized) gives
+    # back the live one, so such specs are the same object and their key is computed once. Only frozen specs can be
+    # interned
+    interned = False
+
     def __init__(self, *args, **kwargs):
         self.initialize(True, *args, **kwargs)
 
@@ -158,10 +249,8 @@ class Spec(object):
         context = locals.copy()
         context.update(globals)
 
-        fields = dict(cls.get_bound_fields())
-
         instance_kwargs = {}
-        for field, field_spec in fields.iteritems():
+        for field, field_spec in cls._schema.bound.fields:
             if isinstance(field_spec, BaseSpecField):
                 if field in context and isinstance(context[field], Spec):
                     # If there's a spec with that name in the context, use it
@@ -205,36 +294,14 @@ class Spec(object):
 
         :param being_created: Tells the method whether *args map to bound or unbound fields
         """
-        pos2name = {}
-        kwargs_field = None
-        args_field = None
-
-        all_fields = dict(self.get_fields())
-        bound_fields = dict(self.get_bound_fields())
-        unbound_fields = dict(self.get_unbound_fields())
-
-        # Check positional arguments
-        for attr_name, attr_type in (bound_fields if being_created else unbound_fields).iteritems():
-            if attr_type.pos is not None:
-                pos2name[attr_type.pos] = attr_name
-
-            elif isinstance(attr_type, KwargsField):
-                # KwargsField always have pos = None
-                if kwargs_field is not None:
-                    raise RuntimeError(
-                        "A spec can have at most one kwargs field, found {} and {}".format(attr_name, kwargs_field))
-                kwargs_field = attr_name
-
-            elif isinstance(attr_type, ArgsField):
-                if args_field is not None:
-                    raise RuntimeError(
-                        "A spec can have at most one args field, found {} and {}".format(attr_name, kwargs_field))
-                args_field = attr_name
-
-        if len(pos2name) == 0:
-            max_nargs = 0
-        else:
-            max_nargs = (max(pos2name) + 1)
+        schema = type(self)._schema
+        all_fields = schema.by_name
+        fields = schema.bound if being_created else schema.unbound
+
+        positional = fields.positional
+        kwargs_field = fields.kwargs_field
+        args_field = fields.args_field
+        max_nargs = len(positional)
 
         if len(args) > max_nargs and args_field is None:
             raise InvalidSpecInstance(
@@ -254,17 +321,16 @@ class Spec(object):
             if args_field is not None and i >= max_nargs:
                 args_param_value.append(arg)
             else:
-                kwargs[pos2name[i]] = arg
+                kwargs[positional[i]] = arg
 
         # Remove args_field from kwargs
         if args_field is not None:
             kwargs.pop(args_field, None)
 
         # Set defaults for missing kwargs, that do have default
-        for attr, attr_type in (bound_fields if being_created else unbound_fields).iteritems():
-            if attr not in kwargs and attr != args_field:
-                if attr_type.has_default_value():
-                    kwargs[attr] = attr_type.default
+        for attr, default in fields.defaults:
+            if attr not in kwargs:
+                kwargs[attr] = default
 
         # If there's an actual kwargs field, put all extra keyword arguments there
         if kwargs_field is not None:
@@ -282,65 +348,246 @@ class Spec(object):
 
         # if being created, you can pass both bound and unbound
         # if being bound, you can only pass unbound fields
-        if len(kwargs) > being_created * len(bound_fields) + len(unbound_fields):
+        if len(kwargs) > being_created * len(schema.bound.fields) + len(schema.unbound.fields):
             raise InvalidSpecInstance(
                 "Class %s does not take the following arguments: %s" % (
-                    type(self).__name__, ", ".join(f for f in kwargs if f not in bound_fields)
+                    type(self).__name__, ", ".join(f for f in kwargs if f not in schema.bound.names)
                 )
             )
 
-        elif len(kwargs) < len(bound_fields if being_created else unbound_fields) - (args_field is not None) - (
-                    kwargs_field is not None):
+        elif len(kwargs) < len(fields.fields) - (args_field is not None) - (kwargs_field is not None):
             raise InvalidSpecInstance(
                 "Missing arguments for class %s: %s" % (
-                    type(self).__name__, ", ".join(f for f in all_fields if f not in kwargs)
+                    type(self).__name__, ", ".join(f for f, _ in schema.fields if f not in kwargs)
                 )
             )
 
         for attr in kwargs:
-            if attr not in (all_fields if being_created else unbound_fields):
+            if attr not in (all_fields if being_created else fields.names):
                 raise InvalidSpecInstance("{} received extra parameter {}".format(type(self).__name__, attr))
 
         # Make sure that everything receives what it expects
+        validators = schema.validators
         for attr, val in kwargs.iteritems():
-            attr_type = all_fields[attr]
-            if val is None: continue
+            check_valid_value = validators[attr]
+            if check_valid_value is None or val is None: continue
 
             # Do not check types for unbound fields yet
             if isinstance(val, UnboundField): continue
 
-            if not attr_type.check_valid_value(val):
-                raise InvalidSpecInstance(
-                    (
-                        "Invalid value for parameter {attr} in {type_name}. " +
-                        "Received {val}, expected {expected_types}\n" +
-                        "If you think {val} is an instance of any of the allowed classes ({expected_types}), then this " +
-                        "might be an issue related to the having reloaded a module containing de definition of {val}"
-                    ).format(
-                        attr=attr,
-                        type_name=type(self).__name__,
-                        val=val,
-                        expected_types=attr_type.allowed_types
-                    )
-                )
+            if not check_valid_value(val): raise type(self)._invalid_value(attr, val)
 
         # Perform set the values to self
         if args_field is not None:
-            setattr(self, args_field, tuple(args_param_value))
+            kwargs[args_field] = tuple(args_param_value)
 
         if kwargs_field is not None:
-            setattr(self, kwargs_field, kwargs_param_value)
-
-        for attr, attr_type in kwargs.iteritems():
-            setattr(self, attr, attr_type)
+            kwargs[kwargs_field] = kwargs_param_value
 
+        self._assign(kwargs)
         return self
 
+    @classmethod
+    def _invalid_value(cls, attr, val):
+        return InvalidSpecInstance(
+            (
+                "Invalid value for parameter {attr} in {type_name}. " +
+                "Received {val}, expected {expected_types}\n" +
+                "If you think {val} is an instance of any of the allowed classes ({expected_types}), then this " +
+                "might be an issue related to the having reloaded a module containing de definition of {val}"
+            ).format(
+                attr=attr,
+                type_name=cls.__name__,
+                val=val,
+                expected_types=cls._schema.by_name[attr].allowed_types
+            )
+        )
+
+    def _assign(self, kwargs):
+        """
+        Sets already validated field values
+        """
+        cls = type(self)
+        if cls.frozen:
+            self._set_values(kwargs)
+        elif cls._plain_setattr:
+            # Same as calling setattr for each value, but faster
+            self._invalidate_key()
+            self.__dict__.update(kwargs)
+        else:
+            for attr, val in kwargs.iteritems():
+                setattr(self, attr, val)
+
+    @classmethod
+    def from_records(cls, rows, compute_keys=False):
+        """
+        Builds many specs of this class, one per row. The fields and the values are checked once per batch instead of
+        once per spec
+
+        :param rows: Either an iterable of dicts mapping field names to values, a pandas DataFrame or a numpy structured
+        array
+        :param compute_keys: Whether to compute the keys of the specs right away
+        :return: A list of specs
+        """
+        if hasattr(rows, 'columns') and hasattr(rows, 'iloc'):
+            # A pandas DataFrame. tolist gives python scalars, which can be serialized
+            return cls._from_columns({name: rows[name].tolist() for name in rows.columns}, compute_keys)
+
+        elif getattr(getattr(rows, 'dtype', None), 'names', None):
+            # A numpy structured array
+            return cls._from_columns({name: rows[name].tolist() for name in rows.dtype.names}, compute_keys)
+
+        # Rows may set different fields, build each group of rows that sets the same ones at once
+        rows = list(rows)
+        groups = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(frozenset(row), []).append(i)
+
+        res = [None] * len(rows)
+        for names, indexes in groups.iteritems():
+            columns = {name: [rows[i][name] for i in indexes] for name in names}
+            for i, spec in zip(indexes, cls._from_columns(columns, compute_keys, len(indexes))):
+                res[i] = spec
+        return res
+
+    @classmethod
+    def from_columns(cls, compute_keys=False, **columns):
+        """
+        Same as :py:meth:`Spec.from_records`, where the values are given as one sequence per field
+
+        >>> Experiment.from_columns(alpha=[0.1, 0.2], beta=[1, 1])
+        [Experiment(alpha=0.1, beta=1), Experiment(alpha=0.2, beta=1)]
+        """
+        return cls._from_columns(columns, compute_keys)
+
+    @classmethod
+    def _from_columns(cls, columns, compute_keys, n_rows=None):
+        names = list(columns)
+        values = [list(columns[name]) for name in names]
+
+        if n_rows is None: n_rows = len(values[0]) if values else 0
+        if any(len(column) != n_rows for column in values):
+            raise ValueError("All the columns must have the same length")
+
+        schema = cls._schema
+        bound = schema.bound
+
+        if (
+            cls.__init__.__func__ is not Spec.__init__.__func__ or
+            bound.args_field is not None or bound.kwargs_field is not None
+        ):
+            # Either the class has to be initialized by its own __init__, or the columns may need to be mapped
+            # to the args and kwargs fields. Let initialize handle them
+            res = [cls(**dict(zip(names, row))) for row in zip(*values)]
+        else:
+            res = cls._build_many(names, values, n_rows)
+
+        if compute_keys:
+            for spec in res: spec.key
+
+        return res
+
+    @classmethod
+    def _build_many(cls, names, values, n_rows):
+        """
+        Does what initialize does for each row, checking everything once per column
+        """
+        schema = cls._schema
+
+        for attr in names:
+            if attr not in schema.by_name:
+                raise InvalidSpecInstance("{} received extra parameter {}".format(cls.__name__, attr))
+
+        names_set = set(names)
+        defaults = [(attr, default) for attr, default in schema.bound.defaults if attr not in names_set]
+        missing = set(schema.bound.names).difference(names).difference(attr for attr, _ in defaults)
+        if missing:
+            raise InvalidSpecInstance("Missing arguments for class %s: %s" % (cls.__name__, ", ".join(sorted(missing))))
+
+        # Make sure that everything receives what it expects
+        for attr, column in chain(zip(names, values), ((attr, [default]) for attr, default in defaults)):
+            check_valid_value = schema.validators[attr]
+            if check_valid_value is None: continue
+
+            for val in column:
+                # Do not check types for unbound fields yet
+                if val is None or isinstance(val, UnboundField): continue
+                if not check_valid_value(val): raise cls._invalid_value(attr, val)
+
+        res = []
+        new = cls.__new__
+        # Brand new instances have no key to invalidate, so plain specs can take the values dict as their __dict__
+        plain = cls._plain_setattr and not cls.frozen
+        for row in izip(*values) if names else repeat((), n_rows):
+            kwargs = dict(defaults)
+            kwargs.update(izip(names, row))
+
+            spec = new(cls)
+            if plain:
+                object.__setattr__(spec, '__dict__', kwargs)
+            else:
+                spec._assign(kwargs)
+            res.append(spec._intern() if cls.interned else spec)
+
+        return res
+
     def copy(self):
-        return type(self)._from_dict(self.to_dict(include_all=True))
+        """
+        Returns a copy of this spec, sub specs included.
+
+        Unless the class customizes how it is loaded (i.e. it overrides `_from_dict`), the copy is built straight from
+        the field values, without serializing the spec. The cached keys are carried over if the copy shares all of its
+        sub specs, otherwise modifying a copied sub spec would leave them stale.
+        Frozen specs can not change, so they are returned as they are
+        """
+        if type(self).frozen: return self
+        return self._copy()
+
+    def _copy(self):
+        return self._copy_tree()[0]
+
+    def _copy_tree(self):
+        """
+        :return: The tuple (copy, whether the copy shares its sub specs with self)
+        """
+        cls = type(self)
+        if cls._from_dict.__func__ is not Spec._from_dict.__func__:
+            return cls._from_dict(self.to_dict(include_all=True)), False
+
+        args, kwargs, shares_subspecs = cls._get_codec().copy_args(self)
+        # Not interned, the result is usually modified right away
+        res = type.__call__(cls, *args, **kwargs)
+        if shares_subspecs: res._copy_key_from(self)
+        return res, shares_subspecs
+
+    def __reduce_ex__(self, protocol):
+        if not type(self).frozen: return super(Spec, self).__reduce_ex__(protocol)
+
+        # Frozen specs can not be restored attribute by attribute, they are built again by the class. That way they are
+        # validated and interned as any other instance
+        args, kwargs = type(self)._get_codec().init_args(self)
+        return _build_spec, (type(self), args, kwargs)
+
+    def _intern(self):
+        try:
+            intern_key = self._intern_key()
+        except TypeError:
+            # A field that is not serialized holds a value that can not be encoded, so it is not known whether another
+            # instance is the same
+            return self
+        return _interned_specs.setdefault(intern_key, self)
+
+    def _intern_key(self):
+        # The key names the class by its import path, which a reloaded or redefined class shares with the old one
+        cls = type(self)
+        # The key leaves out the fields that are not serialized, instances that only differ on them are not the same
+        if cls._get_codec().key_has_all_fields: return cls, self.key
+        return cls, self._dict2key(self.to_dict(include_all=True))
 
     def replace(self, **kwargs):
-        res = self.copy()
+        res, shares_subspecs = self._copy_tree()
+        # Fields that are not serialized are not part of the key
+        keeps_key = shares_subspecs
         for attr, val in kwargs.iteritems():
             field_spec = self.get_field_spec(attr)
 
@@ -349,8 +596,12 @@ class Spec(object):
                     "Invalid value for field {}. Received {}, expected {}".format(attr, val, field_spec.allowed_types)
                 )
 
-            setattr(res, attr, val)
-        return res
+            if not res.frozen: setattr(res, attr, val)
+            keeps_key = keeps_key and not field_spec.serialize
+
+        if res.frozen: res._set_values(kwargs)
+        if keeps_key: res._copy_key_from(self)
+        return res._intern() if res.interned else res
 
     @classmethod
     def get_field_spec(cls, field_name):
@@ -359,28 +610,97 @@ class Spec(object):
         return res
 
     def get_spec_fields(self):
-        res = {}
-        for attr, attr_type in type(self).get_fields():
-            if isinstance(attr_type, BaseSpecField):
-                res[attr] = getattr(self, attr)
-        return res
+        return {attr: getattr(self, attr) for attr in type(self)._schema.spec_fields}
 
     def get_primitive_fields(self):
-        res = {}
-        for attr, attr_type in type(self).get_fields():
-            if isinstance(attr_type, PrimitiveField):
-                res[attr] = getattr(self, attr)
-        return res
+        return {attr: getattr(self, attr) for attr in type(self)._schema.primitive_fields}
 
     @memoized_property
     def key(self):
-        return self._dict2key(self.to_dict(include_all=False))
+        if self.merkle_keys:
+            return self._dict2key(self._merkle_dict())
+        else:
+            return self._dict2key(self.to_dict(include_all=False))
+
+    @memoized_property
+    def digest(self):
+        """
+        Fixed size digest of `self.key`. It is what caches and data stores use as lookup handle,
+        the full key is only needed to verify a match
+        """
+        return key_digest(self.key)
+
+    @memoized_property
+    def serialized_key(self):
+        """
+        A key that can be loaded back with :py:func:`Spec.key2spec`.
+        It is the same as `self.key` unless `merkle_keys` is enabled
+        """
+        if self.merkle_keys:
+            return self._dict2key(self.to_dict(include_all=False))
+        else:
+            return self.key
+
+    def _merkle_dict(self):
+        """
+        Same as `self.to_dict()`, but the sub specs are replaced by the digest of their keys.
+        Since the sub specs memoize their keys, the cost is proportional to the number of sub specs that changed
+        """
+        previous = getattr(_key_encoding, 'spec', None)
+        _key_encoding.spec = self
+        try:
+            return self.to_dict(include_all=False)
+        finally:
+            _key_encoding.spec = previous
+
+    @staticmethod
+    def _subspec_reference(spec):
+        return {'digest': spec.digest}
 
     def __setattr__(self, key, value):
-        # invalidate key cache if you change the object
-        if hasattr(self, '_key'): del self._key
+        cls = type(self)
+        if cls.frozen and key not in _cached_keys:
+            raise AttributeError("{} instances are frozen".format(cls.__name__))
+
+        # invalidate key cache if you change a field of the object, other attributes are not part of the key
+        if key in cls._schema.by_name: self._invalidate_key()
         return super(Spec, self).__setattr__(key, value)
 
+    def _invalidate_key(self):
+        if type(self).frozen:
+            # Do not touch __dict__, it is not even allocated
+            for attr in _cached_keys:
+                if hasattr(self, attr): object.__delattr__(self, attr)
+        else:
+            d = self.__dict__
+            for attr in _cached_keys:
+                d.pop(attr, None)
+
+    def _copy_key_from(self, other):
+        """
+        Reuses the cached keys of `other`, that must have the same key as `self`
+        """
+        for attr in _cached_keys:
+            if hasattr(other, attr): object.__setattr__(self, attr, getattr(other, attr))
+
+    def _set_values(self, kwargs):
+        """
+        Sets the values of the fields of a frozen spec. Only meant to be used while the spec is being built
+        """
+        cls = type(self)
+        if hasattr(self, '_values'):
+            values = list(self._values)
+        else:
+            # Fields not set yet (i.e. unbound ones) hold the field itself, as they do on regular specs
+            values = [attr_type for _, attr_type in cls._schema.fields]
+
+        index = cls._field_index
+        for attr, val in kwargs.iteritems():
+            values[index[attr]] = val
+
+        object.__setattr__(self, '_values', tuple(values))
+        self._invalidate_key()
+
     def to_kwargs(self, include_all=False):
         """
         Useful function to call f(**spec.to_kwargs())
@@ -399,12 +719,13 @@ class Spec(object):
 
     @property
     def yaml(self, include_all=False):
+        import yaml
         yaml.dumps = yaml.dump
         return Spec.Exporter(yaml, self.to_dict(include_all=include_all), default_flow_style=False)
 
     @property
     def json(self, include_all=False):
-        return Spec.Exporter(json, self.to_dict(include_all=include_all), indent=2)
+        return Spec.Exporter(json_codec.codec, self.to_dict(include_all=include_all), indent=2)
 
     class Importer(object):
         def __init__(self, cls, module):
@@ -419,36 +740,33 @@ class Spec(object):
 
     @classmethod
     def from_json(cls):
-        return Spec.Importer(cls, json)
+        return Spec.Importer(cls, json_codec.codec)
 
     @classmethod
     def from_yaml(cls):
+        import yaml
         yaml.loads = yaml.load
         return Spec.Importer(cls, yaml)
 
     @classmethod
     def get_fields(cls):
-        for k in dir(cls):
-            v = getattr(cls, k)
-            if isinstance(v, Field):
-                yield k, v
+        return iter(cls._schema.fields)
 
     @classmethod
     def get_unbound_fields(cls):
-        for k, v in cls.get_fields():
-            if isinstance(v, UnboundField):
-                yield k, v
+        return iter(cls._schema.unbound.fields)
 
     @classmethod
     def get_bound_fields(cls):
-        for k, v in cls.get_fields():
-            if not isinstance(v, UnboundField):
-                yield k, v
+        return iter(cls._schema.bound.fields)
 
     def bind(self, *args, **kwargs):
-        return self.copy().initialize(False, *args, **kwargs)
+        res = self._copy().initialize(False, *args, **kwargs)
+        return res._intern() if res.interned else res
 
     def inplace_bind(self, *args, **kwargs):
+        if self.frozen:
+            raise AttributeError("{} instances are frozen, use bind instead".format(type(self).__name__))
         return self.initialize(False, *args, **kwargs)
 
     @classmethod
@@ -475,17 +793,29 @@ class Spec(object):
         if not isinstance(spec_type, dict) and not isinstance(spec_type, basestring):
             raise ValueError("Invalid type for spec_type")
 
-        if (isinstance(spec_type, dict) or
-                    ':' in spec_type or
-                    '.' in spec_type):
-
+        if isinstance(spec_type, dict):
             cls = obj_from_path(spec_type)
-            assert issubclass(cls, Spec), "The provided path does not point to an Spec subclass"
-            return cls
+
+        elif ':' in spec_type or '.' in spec_type:
+            cls = _spec_classes_by_path.get(spec_type)
+
+            # Only trust the registry if the class is what the import statement would give
+            if cls is None or getattr(sys.modules.get(cls.__module__), cls.__name__, None) is not cls:
+                cls = obj_from_path(spec_type)
+
         else:
             # Then assume it's the name of the class, this is somewhat legacy
+            cls = _spec_classes_by_name.get(spec_type)
+            if cls is not None: return cls
+
             for cls in Spec._get_all_subclasses():
-                if cls.__name__ == spec_type: return cls
+                if cls.__name__ == spec_type:
+                    cls._register()
+                    return cls
+            return None
+
+        assert issubclass(cls, Spec), "The provided path does not point to an Spec subclass"
+        return cls
 
     @staticmethod
     def dict2spec(dict, path=None):
@@ -503,6 +833,91 @@ class Spec(object):
 
         return cls._from_dict(dict, path=path)
 
+    @staticmethod
+    def dict2spec_many(dicts, path=None, on_error=None, batch_size=1000):
+        """
+        Same as `(Spec.dict2spec(d, path=path) for d in dicts)`, but faster when loading many specs.
+        The dictionaries are processed in batches, grouped by type, so that each class is resolved once
+
+        :param dicts: Iterable of dictionaries, it is consumed lazily
+        :param on_error: If given, `on_error(dict, exception)` is called when a dictionary can not be loaded, and its
+        result is given instead of the spec. Otherwise the exception is raised
+        :param batch_size: How many dictionaries are held in memory at most
+        :return: A generator of specs, in the same order as `dicts`
+        """
+        classes = {}
+        batch = []
+        for d in dicts:
+            batch.append(d)
+            if len(batch) == batch_size:
+                for spec in Spec._dict2spec_batch(batch, classes, path, on_error): yield spec
+                batch = []
+
+        for spec in Spec._dict2spec_batch(batch, classes, path, on_error): yield spec
+
+    @staticmethod
+    def _dict2spec_batch(dicts, classes, path, on_error):
+        """
+        :param classes: Cache from type to class, shared by all the batches of a dict2spec_many call
+        """
+        res = [None] * len(dicts)
+
+        def load_one(i, cls):
+            try:
+                res[i] = cls._from_dict(dicts[i], path=path)
+            except Exception, e:
+                if on_error is None: raise
+                res[i] = on_error(dicts[i], e)
+
+        groups = OrderedDict()
+        for i, d in enumerate(dicts):
+            try:
+                spec_type = d['type']
+                cls = classes.get(spec_type) if isinstance(spec_type, basestring) else None
+                if cls is None:
+                    cls = Spec.type2spec_class(spec_type)
+                    if cls is None:
+                        raise ValueError(
+                            "Unknown spec type: {}\n".format(spec_type) +
+                            "This might happen if you are referencing an Spec that hasn't been imported"
+                        )
+                    if isinstance(spec_type, basestring): classes[spec_type] = cls
+            except Exception, e:
+                if on_error is None: raise
+                res[i] = on_error(d, e)
+                continue
+
+            groups.setdefault(cls, []).append(i)
+
+        for cls, indexes in groups.iteritems():
+            if cls._from_dict.__func__ is not Spec._from_dict.__func__:
+                # The class customizes how it is loaded
+                for i in indexes: load_one(i, cls)
+                continue
+
+            kwargs_list = []
+            for i in indexes:
+                kwargs = dicts[i].copy()
+                kwargs.pop('type')
+                kwargs_list.append(kwargs)
+
+            try:
+                decoded = cls._get_codec().decode_many(kwargs_list, path=path)
+            except Exception:
+                if on_error is None: raise
+                # Find out which ones failed
+                for i in indexes: load_one(i, cls)
+                continue
+
+            for i, (args, kwargs) in zip(indexes, decoded):
+                try:
+                    res[i] = cls(*args, **kwargs)
+                except Exception, e:
+                    if on_error is None: raise
+                    res[i] = on_error(dicts[i], e)
+
+        return res
+
     @staticmethod
     def key2spec(str):
         try:
@@ -517,20 +932,21 @@ class Spec(object):
         return hash(self.key)
 
     def __eq__(self, other):
+        if self is other: return True
         return isinstance(other, Spec) and self.key == other.key
 
     def __lt__(self, other):
         return self.key < other.key
 
     def __ne__(self, other):
-        return self.key != other.key
+        return not self == other
 
     def to_dict(self, include_all=False):
         """
         :param include_toggles: Wether to include or not toggle_fields, default=False
         """
         import_path = get_import_path(type(self))
-        if inspect.getmodule(type(self)).__name__ == '__main__':
+        if import_path.startswith('__main__:'):
             warnings.warn(
                 """
                 The module of {} is __main__.
@@ -541,100 +957,33 @@ class Spec(object):
 
         res = {'type': import_path}
 
-        for attr, attr_type in self.get_fields():
-            val = getattr(self, attr)
-
-            # Do not consider fields not bound yet
-            if isinstance(val, UnboundField): continue
-
-            if isinstance(attr_type, PrimitiveField) and (attr_type.serialize or include_all):
-                if inspect.isfunction(val) or inspect.isclass(val):
-                    val = 'import {}'.format(get_import_path(val))
-                elif isinstance(val, basestring) and val.startswith('import '):
-                    val = '!!{}'.format(val)
-
-                res[attr] = val
-
-            elif isinstance(attr_type, BaseSpecField) and (include_all or attr_type.serialize):
-                res[attr] = val if val is None else val.to_dict(include_all=include_all)
-
-            elif isinstance(attr_type, SpecCollection) and (include_all or attr_type.serialize):
-                def f(obj):
-                    if isinstance(obj, Spec):
-                        return obj.to_dict(include_all=include_all)
-                    else:
-                        return obj
+        # Whether we are building the merkle key of this spec
+        if getattr(_key_encoding, 'spec', None) is self:
+            encode_spec = self._subspec_reference
+        else:
+            encode_spec = lambda spec: spec.to_dict(include_all=include_all)
 
-                res[attr] = recursive_map(val, f)
-
-        return res
+        return type(self)._get_codec().encode(self, res, include_all, encode_spec)
 
     @classmethod
     def _from_dict(cls, kwargs, path=None):
         kwargs = kwargs.copy()
         kwargs.pop('type')
-        args = tuple()
-
-        for attr, attr_type in cls.get_fields():
-            if attr not in kwargs and isinstance(attr_type, UnboundField):
-                continue
-            elif attr_type.has_default_value():
-                val = kwargs.get(attr, attr_type.default)
-            else:
-                val = kwargs[attr]
-
-            if isinstance(attr_type, PrimitiveField) and isinstance(val, basestring):
-                if val.startswith('import '):
-                    kwargs[attr] = obj_from_path(val[len('import '):])
-                elif val.startswith('!!import'):
-                    kwargs[attr] = val[2:]
-
-            elif isinstance(attr_type, BaseSpecField) and val is not None and attr in kwargs:
-                if isinstance(val, basestring):
-                    if not os.path.exists(val) and path is not None:
-                        if not os.path.exists(os.path.join(path, val)):
-                            raise RuntimeError(
-                                "Could not load referenced file ({}) for attribute {}".format(val, attr)
-                            )
-                        val = os.path.join(path, val)
-
-                    if val.endswith('.yaml'):
-                        with open(val) as f:
-                            val = yaml.load(f)
-                    elif val.endswith('.json'):
-                        with open(val) as f:
-                            val = json.load(f)
-                    else:
-                        raise RuntimeError('Invalid extension for referenced attribute {}, path: {}'.format(attr, val))
-
-                # should be a dict
-                kwargs[attr] = Spec.dict2spec(val, path=path)
-
-            elif isinstance(attr_type, SpecCollection):
-                def f(obj):
-                    try:
-                        return Spec.dict2spec(obj)
-                    except:
-                        return obj
-
-                def recursion_condition(obj):
-                    try:
-                        # TODO: this masks errors in a very ugly way
-                        Spec.dict2spec(obj)
-                        return False
-                    except:
-                        return is_iterable(obj)
-
-                val = recursive_map(val, f, recursion_condition)
-                if isinstance(attr_type, ArgsField):
-                    args = tuple(val)
-                elif isinstance(attr_type, KwargsField):
-                    kwargs.update(val)
-                else:
-                    kwargs[attr] = val
-
+        args, kwargs = cls._get_codec().decode(kwargs, path=path)
         return cls(*args, **kwargs)
 
+    @classmethod
+    def _get_codec(cls):
+        """
+        Returns the :py:class:`SpecCodec` of this class, compiling it if the class has not been (de)serialized yet or
+        if its fields changed
+        """
+        codec = cls.__dict__.get('_codec')
+        if codec is None or codec.schema is not cls._schema:
+            codec = SpecCodec(cls._schema)
+            type.__setattr__(cls, '_codec', codec)
+        return codec
+
     @classmethod
     def _dict2key(cls, d):
         def prepare_dict(input):
@@ -645,30 +994,46 @@ class Spec(object):
             return output
 
         d = prepare_dict(d)
-        return json.dumps({'transformed': True, 'dict': sorted(d.iteritems(), key=lambda x: x[0])})
+        return json_codec.codec.dumps({'transformed': True, 'dict': sorted(d.iteritems(), key=lambda x: x[0])})
+
+    @staticmethod
+    def dict2digest(dict):
+        """
+        Computes the digest of the spec represented by `dict`.
+        The spec is only loaded when its class uses merkle keys, otherwise the digest is computed from the dict
+        """
+        spec_type = dict.get('type')
+        if isinstance(spec_type, basestring) and '@' not in spec_type:
+            try:
+                cls = Spec.type2spec_class(spec_type)
+            except Exception:
+                cls = None
+
+            if cls is not None and cls.merkle_keys:
+                return cls._from_dict(dict).digest
+
+        return key_digest(Spec._dict2key(dict))
 
     @classmethod
     def key2dict(cls, str):
         if str.startswith('/'): str = str[1:]
-        return cls._key2dict(json.loads(str))
+        return cls._key2dict(json_codec.codec.loads(str))
 
     @classmethod
     def _key2dict(cls, obj):
         if isinstance(obj, dict) and obj.get('transformed') is True and 'dict' in obj:
             res = dict(obj['dict'])
             for k, v in res.iteritems():
-                res[k] = cls._key2dict(v)
+                # Only dicts may need to be transformed
+                if isinstance(v, dict): res[k] = cls._key2dict(v)
             return res
         else:
             return obj
 
     @classmethod
     def get_default_doc_string(cls):
-        fields = list(cls.get_fields())
-        fields.sort(key=lambda x: x[1].pos or len(fields))
-
         res = ['\n\t{} fields: '.format(cls.__name__)]
-        for attr, attr_type in fields:
+        for attr, attr_type in cls._schema.display_order:
             res.append('\t\t{} = {}'.format(attr, attr_type))
 
         return '\n'.join(res) + '\n'
@@ -695,14 +1060,11 @@ class Spec(object):
         return Diff.build(other.to_dict(), self.to_dict())
 
     def __repr__(self):
-        signature = list(self.get_fields())
-        signature.sort(key=lambda x: x[1].pos or len(signature))
-
         fields = OrderedDict()
-        for field_name, field_spec in signature:
+        for field_name, field_spec in type(self)._schema.display_order:
             val = getattr(self, field_name)
             # Do not print default values
-            if val == field_spec.default: continue
+            if _is_default(val, field_spec): continue
 
             if isinstance(field_spec, BaseSpecField):
                 fields[field_name] = '{}(...)'.format(type(val).__name__)
@@ -716,6 +1078,19 @@ class Spec(object):
         )
 
 
+def _build_spec(cls, args, kwargs):
+    return cls(*args, **kwargs)
+
+
+def _is_default(val, field_spec):
+    if val is field_spec.default: return True
+    try:
+        return bool(val == field_spec.default)
+    except ValueError:
+        # Comparisons that do not give a bool, like the ones of numpy arrays
+        return False
+
+
 def is_import_path(obj):
     try:
         return obj != obj_from_path(obj)
@@ -723,6 +1098,37 @@ def is_import_path(obj):
         return False
 
 
+class ResolutionCache(object):
+    """
+    Bounded FIFO cache used to memoize import path resolutions
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        if key not in self.data and len(self.data) >= self.size:
+            self.data.popitem(False)
+        self.data[key] = value
+
+    def pop(self, key):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+
+# class or function -> import path. Like the registries of Spec subclasses, it does not keep dynamically created classes
+# alive (e.g. the ones made by as_operation, or the ones replaced by a reload)
+_import_path_cache = WeakKeyDictionary()
+# import path -> (module, first attribute name, first attribute value, object). The values are held through _weak_ref
+_obj_from_path_cache = ResolutionCache(10000)
+
+
 def get_import_path(obj, *attrs):
     """
     Builds a string representing an object.
@@ -737,8 +1143,6 @@ def get_import_path(obj, *attrs):
 
     The inverse function of get_import_path is obj_from_path
     """
-    mod = inspect.getmodule(obj)
-
     if isinstance(obj, Spec):
         if len(attrs) == 1:
             res = {
@@ -754,9 +1158,11 @@ def get_import_path(obj, *attrs):
 
     else:
         if inspect.isclass(obj) or inspect.isfunction(obj):
-            res = '{}:{}'.format(mod.__name__, obj.__name__)
+            res = _import_path_cache.get(obj)
+            if res is None:
+                res = _import_path_cache[obj] = '{}:{}'.format(inspect.getmodule(obj).__name__, obj.__name__)
         else:
-            res = '{}:{}@{}'.format(mod.__name__, type(obj).__name__, id(obj))
+            res = '{}:{}@{}'.format(inspect.getmodule(obj).__name__, type(obj).__name__, id(obj))
 
         if attrs:
             for attr in attrs:
@@ -794,40 +1200,80 @@ def obj_from_path(path):
             res = getattr(res, attr)
         return res
 
+    elif '@' in path:
+        # Ids can be reused, do not cache these ones
+        return _resolve_path(path)[-1]
+
     else:
-        parts = path.split(':')
-        assert len(parts) <= 2
+        cached = _obj_from_path_cache.get(path)
+        if cached is not None:
+            module, top_attr, top_ref, ref = cached
+            obj = ref()
+
+            # A reloaded module keeps the module object but rebinds its attributes
+            if obj is not None and sys.modules.get(module.__name__) is module and \
+                    (top_attr is None or module.__dict__.get(top_attr) is top_ref()):
+                return obj
+
+        module, top_attr, top_obj, obj = _resolve_path(path)
+        _obj_from_path_cache.set(path, (module, top_attr, _weak_ref(top_obj), _weak_ref(obj)))
+        return obj
 
-        obj_path = []
-        full_path = parts[0]
-        if len(parts) == 2:
-            obj_path = parts[1].split('.')
 
-        fromlist = '.'.join(full_path.split('.')[:-1])
+def _weak_ref(obj):
+    """
+    :return: A function that returns `obj`, or None once it was collected. Objects that can not be weakly referenced
+    (e.g. constants) are held by it
+    """
+    try:
+        return weak_ref(obj)
+    except TypeError:
+        return lambda: obj
 
-        try:
-            module = __import__(full_path, fromlist=fromlist)
-        except WeirdModulePathException, e:
-            # This on is thrown by SpecMeta when there's a ".." inside a class path
-            # I don't know yet why this happens, but at least I know *when* it does happen :)
-            traceback.print_exc()
-            raise RuntimeError("Couldn't import {}".format(path) + '\n' + e.args[0])
-        except ImportError:
-            traceback.print_exc()
-            raise RuntimeError("Couldn't import {}".format(path))
-
-        obj = module
-        for i, attr in enumerate(obj_path):
-            if '@' in attr:
-                assert i == 0
-                attr, id = attr.split('@')
-                klass = getattr(obj, attr)
-                instance = load_object(int(id))
-                assert isinstance(instance, klass)
-                obj = instance
-            else:
-                obj = getattr(obj, attr)
-        return obj
+
+def _resolve_path(path):
+    """
+    Does the actual work of obj_from_path for string paths
+
+    :return: A tuple (module, first attribute name, first attribute value, object)
+    """
+    parts = path.split(':')
+    assert len(parts) <= 2
+
+    obj_path = []
+    full_path = parts[0]
+    if len(parts) == 2:
+        obj_path = parts[1].split('.')
+
+    fromlist = '.'.join(full_path.split('.')[:-1])
+
+    try:
+        module = __import__(full_path, fromlist=fromlist)
+    except WeirdModulePathException, e:
+        # This on is thrown by SpecMeta when there's a ".." inside a class path
+        # I don't know yet why this happens, but at least I know *when* it does happen :)
+        traceback.print_exc()
+        raise RuntimeError("Couldn't import {}".format(path) + '\n' + e.args[0])
+    except ImportError:
+        traceback.print_exc()
+        raise RuntimeError("Couldn't import {}".format(path))
+
+    obj = module
+    top_obj = None
+    for i, attr in enumerate(obj_path):
+        if '@' in attr:
+            assert i == 0
+            attr, id = attr.split('@')
+            klass = getattr(obj, attr)
+            instance = load_object(int(id))
+            assert isinstance(instance, klass)
+            obj = instance
+        else:
+            obj = getattr(obj, attr)
+
+        if i == 0: top_obj = obj
+
+    return module, obj_path[0] if obj_path else None, top_obj, obj
 
 
 def load_object(id):
@@ -0,0 +1,309 @@
+"""
+Per class encoders and decoders used by :py:meth:`Spec.to_dict` and :py:meth:`Spec._from_dict`.
+
+They are compiled from the field schema of each Spec subclass the first time it is (de)serialized, so that the
+per field branching is done once per class instead of once per instance
+"""
+import inspect
+import os
+from types import NoneType
+
+import base
+from fito.specs import json_codec, content_hash
+from fito.specs.fields import PrimitiveField, BaseSpecField, SpecCollection, ArgsField, KwargsField, UnboundField
+from fito.specs.utils import recursive_map, is_iterable
+
+# Values of these types are serialized as they are
+_plain_types = frozenset([int, long, float, bool, NoneType])
+
+PRIMITIVE, SPEC, COLLECTION, ARGS, KWARGS, OTHER = range(6)
+
+
+def field_kind(attr_type):
+    if isinstance(attr_type, PrimitiveField):
+        return PRIMITIVE
+    elif isinstance(attr_type, BaseSpecField):
+        return SPEC
+    elif isinstance(attr_type, ArgsField):
+        return ARGS
+    elif isinstance(attr_type, KwargsField):
+        return KWARGS
+    elif isinstance(attr_type, SpecCollection):
+        return COLLECTION
+    else:
+        return OTHER
+
+
+def encode_primitive(val, encode_spec):
+    if type(val) in _plain_types:
+        return val
+    elif inspect.isfunction(val) or inspect.isclass(val):
+        return 'import {}'.format(base.get_import_path(val))
+    elif isinstance(val, basestring):
+        return '!!{}'.format(val) if val.startswith('import ') else val
+    else:
+        # Data, like numpy arrays, is replaced by a digest of its contents
+        return content_hash.encode(val)
+
+
+def encode_spec_field(val, encode_spec):
+    return val if val is None else encode_spec(val)
+
+
+def encode_collection(val, encode_spec):
+    """
+    Same as `recursive_map(val, f)` where f encodes the specs, without the overhead of recursive_map
+    """
+    val_type = type(val)
+    if val_type is list or val_type is tuple:
+        res = [_encode_element(e, encode_spec) for e in val]
+        return res if val_type is list else tuple(res)
+
+    elif val_type is dict:
+        return {k: _encode_element(v, encode_spec) for k, v in val.iteritems()}
+
+    else:
+        # Subclasses of the builtin collections, or invalid values. Let recursive_map handle them
+        def f(obj):
+            if isinstance(obj, base.Spec):
+                return encode_spec(obj)
+            else:
+                return obj
+
+        return recursive_map(val, f)
+
+
+def _encode_element(obj, encode_spec):
+    if isinstance(obj, base.Spec):
+        return encode_spec(obj)
+    elif is_iterable(obj):
+        return encode_collection(obj, encode_spec)
+    else:
+        return obj
+
+
+_encoders = {
+    PRIMITIVE: encode_primitive,
+    SPEC: encode_spec_field,
+    COLLECTION: encode_collection,
+    ARGS: encode_collection,
+    KWARGS: encode_collection,
+}
+
+
+def load_referenced_spec(val, attr, path):
+    """
+    Loads the dictionary of a sub spec that was serialized into another file
+    """
+    if not os.path.exists(val) and path is not None:
+        if not os.path.exists(os.path.join(path, val)):
+            raise RuntimeError(
+                "Could not load referenced file ({}) for attribute {}".format(val, attr)
+            )
+        val = os.path.join(path, val)
+
+    if val.endswith('.yaml'):
+        import yaml
+        with open(val) as f:
+            return yaml.load(f)
+    elif val.endswith('.json'):
+        with open(val) as f:
+            return json_codec.codec.load(f)
+    else:
+        raise RuntimeError('Invalid extension for referenced attribute {}, path: {}'.format(attr, val))
+
+
+def decode_collection(val, path=None):
+    """
+    Loads the specs inside a collection. Dictionaries with a 'type' key are loaded as specs, the rest of the
+    collections are traversed
+    """
+    val_type = type(val)
+    if val_type is list or val_type is tuple:
+        res = [_decode_element(e, path) for e in val]
+        return res if val_type is list else tuple(res)
+
+    elif val_type is dict:
+        return {k: _decode_element(v, path) for k, v in val.iteritems()}
+
+    else:
+        # Subclasses of the builtin collections
+        return recursive_map(val, lambda obj: _decode_element(obj, path), recursion_condition=_is_plain_collection)
+
+
+def _decode_element(obj, path):
+    if isinstance(obj, dict) and 'type' in obj:
+        return base.Spec.dict2spec(obj, path=path)
+    elif is_iterable(obj):
+        return decode_collection(obj, path)
+    else:
+        return obj
+
+
+def _is_plain_collection(obj):
+    return is_iterable(obj) and not (isinstance(obj, dict) and 'type' in obj)
+
+
+class SpecCodec(object):
+    """
+    Encoder and decoder of an Spec subclass, compiled from its :py:class:`FieldSchema`
+
+    :ivar encoders: Maps include_all to a tuple of (field name, encoding function) pairs
+    :ivar decoders: Tuple of (field name, kind, is unbound, has default, default) tuples
+    :ivar kinds: Tuple of (field name, kind) pairs
+    :ivar key_has_all_fields: Whether the key of an instance holds all of its values, that is, every field is
+    serialized and none of them holds sub specs
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.encoders = {
+            True: self._build_encoders(schema.fields),
+            False: self._build_encoders(schema.serialized),
+        }
+
+        self.decoders = tuple(
+            (
+                attr,
+                field_kind(attr_type),
+                isinstance(attr_type, UnboundField),
+                attr_type.has_default_value(),
+                attr_type.default
+            )
+            for attr, attr_type in schema.fields
+        )
+
+        self.kinds = tuple((attr, field_kind(attr_type)) for attr, attr_type in schema.fields)
+        self.key_has_all_fields = (
+            len(schema.serialized) == len(schema.fields) and all(kind == PRIMITIVE for _, kind in self.kinds)
+        )
+        self.bound_positional = schema.bound.positional
+
+    @staticmethod
+    def _build_encoders(fields):
+        res = []
+        for attr, attr_type in fields:
+            kind = field_kind(attr_type)
+            # Other kinds of fields are not serialized
+            if kind != OTHER: res.append((attr, _encoders[kind]))
+        return tuple(res)
+
+    def encode(self, spec, res, include_all, encode_spec):
+        """
+        Adds the fields of `spec` to `res`
+        :param encode_spec: Function used to encode the sub specs
+        """
+        for attr, encode in self.encoders[bool(include_all)]:
+            val = getattr(spec, attr)
+
+            # Do not consider fields not bound yet
+            if isinstance(val, UnboundField): continue
+
+            res[attr] = encode(val, encode_spec)
+
+        return res
+
+    def decode(self, kwargs, path=None):
+        """
+        Decodes the fields in `kwargs` (that has no 'type' key) in place
+
+        :return: The tuple (args, kwargs) the class should be instanced with
+        """
+        args = tuple()
+
+        for attr, kind, is_unbound, has_default, default in self.decoders:
+            if attr in kwargs:
+                val = kwargs[attr]
+                in_kwargs = True
+            elif is_unbound:
+                continue
+            elif has_default:
+                val = default
+                in_kwargs = False
+            else:
+                raise KeyError(attr)
+
+            if kind == PRIMITIVE:
+                if isinstance(val, basestring):
+                    if val.startswith('import '):
+                        kwargs[attr] = base.obj_from_path(val[len('import '):])
+                    elif val.startswith('!!import'):
+                        kwargs[attr] = val[2:]
+
+            elif kind == SPEC:
+                if val is not None and in_kwargs:
+                    if isinstance(val, basestring):
+                        val = load_referenced_spec(val, attr, path)
+
+                    # should be a dict
+                    kwargs[attr] = base.Spec.dict2spec(val, path=path)
+
+            elif kind == ARGS:
+                args = tuple(decode_collection(val, path))
+
+            elif kind == KWARGS:
+                kwargs.update(decode_collection(val, path))
+
+            elif kind == COLLECTION:
+                kwargs[attr] = decode_collection(val, path)
+
+        return args, kwargs
+
+    def decode_many(self, kwargs_list, path=None):
+        """
+        Same as `decode`, for a list of records of this class
+
+        :return: A list of (args, kwargs) tuples
+        """
+        decode = self.decode
+        return [decode(kwargs, path=path) for kwargs in kwargs_list]
+
+    def copy_args(self, spec):
+        """
+        Builds the arguments to create a copy of `spec`. Sub specs are copied, the rest of the values are shared
+
+        :return: The tuple (args, kwargs, shares_subspecs). The class should be instanced with args and kwargs.
+        shares_subspecs tells whether the copies of all the sub specs are the sub specs themselves (i.e. they are frozen)
+        """
+        # Sub specs whose copy is another object
+        copied = []
+
+        def copy_spec(subspec):
+            res = subspec.copy()
+            if res is not subspec: copied.append(res)
+            return res
+
+        args, kwargs = self.init_args(spec, copy_spec)
+        return args, kwargs, not copied
+
+    def init_args(self, spec, copy_spec=None):
+        """
+        :param copy_spec: Function applied to the sub specs. By default they are used as they are
+        :return: The tuple (args, kwargs) that builds `spec` when the class is instanced with it
+        """
+        args = None
+        kwargs = {}
+
+        for attr, kind in self.kinds:
+            val = getattr(spec, attr)
+
+            # Do not consider fields not bound yet
+            if isinstance(val, UnboundField): continue
+
+            if copy_spec is not None:
+                if kind == SPEC:
+                    if val is not None: val = copy_spec(val)
+                elif kind == COLLECTION or kind == ARGS or kind == KWARGS:
+                    val = encode_collection(val, copy_spec)
+
+            if kind == ARGS:
+                args = tuple(val)
+            elif kind == KWARGS:
+                kwargs.update(val)
+            else:
+                kwargs[attr] = val
+
+        if args is None: return (), kwargs
+
+        # The values of the args field come after the positional fields
+        return tuple(kwargs.pop(attr) for attr in self.bound_positional) + args, kwargs
@@ -0,0 +1,114 @@
+"""
+Content hashes for primitive field values that can not (or should not) be serialized as they are, like numpy arrays.
+
+:py:meth:`Spec.to_dict` replaces such values by a small dictionary holding their type, their dtype and shape, and a digest
+of their contents. That way specs (e.g. operations created with `as_operation`) can take data as arguments and still
+have a key, so they can be cached. The digest can not be loaded back into the original value.
+
+>>> Spec.key2dict(Mean(np.arange(3)).key)
+{'type': '...:Mean', 'data': {'$content': 'numpy:ndarray', 'dtype': '<i8', 'shape': [3], 'md5': '...'}}
+
+Types are registered by import path, so the registry does not import numpy nor pandas
+"""
+import hashlib
+
+from fito.specs import json_codec
+from fito.type_registry import TypeRegistry, import_path
+
+_encoders = TypeRegistry()
+
+
+def register(cls, encoder):
+    """
+    Registers the content hash encoder of a class, which also applies to its subclasses
+
+    :param cls: The class or its import path ('module:Class'). Prefer the import path for optional dependencies
+    :param encoder: Function that receives an instance and returns a dictionary that is JSON serializable. It must not
+    depend on the identity of the instance
+    """
+    _encoders.register(cls, encoder)
+
+
+def get_encoder(cls):
+    """
+    :return: The content hash encoder for instances of `cls`, or None if it has none
+    """
+    return _encoders.get(cls)
+
+
+def encode(val):
+    """
+    :return: The content hash of `val`, or `val` itself if its type has no registered encoder
+    """
+    encoder = _encoders.get(type(val))
+    if encoder is None: return val
+    return encoder(val)
+
+
+def is_content_hash(val):
+    return isinstance(val, dict) and '$content' in val
+
+
+def _content(val, **kwargs):
+    kwargs['$content'] = import_path(type(val))
+    return kwargs
+
+
+def buffer_digest(buf):
+    """
+    md5 of anything that has the buffer interface, without copying it
+    """
+    return hashlib.md5(buf).hexdigest()
+
+
+def encode_ndarray(arr):
+    if arr.dtype.hasobject:
+        # The buffer holds pointers, hash the values instead
+        digest = buffer_digest(json_codec.codec.dumps(arr.tolist(), sort_keys=True))
+    else:
+        # Only non contiguous arrays get copied. Hashing the raw bytes makes the digest depend on the byte order,
+        # that is also part of dtype.str
+        import numpy as np
+        digest = buffer_digest(np.ascontiguousarray(arr).view('u1'))
+
+    return _content(arr, dtype=arr.dtype.str, shape=list(arr.shape), md5=digest)
+
+
+def _hash_pandas(obj):
+    from pandas.util import hash_pandas_object
+    # One vectorized uint64 hash per row, index included
+    return buffer_digest(hash_pandas_object(obj, index=True).values)
+
+
+def encode_series(series):
+    return _content(
+        series, dtype=str(series.dtype), name=_encode_label(series.name), shape=[len(series)], md5=_hash_pandas(series)
+    )
+
+
+def encode_dataframe(df):
+    return _content(
+        df,
+        columns=[_encode_label(c) for c in df.columns],
+        dtypes=[str(dtype) for dtype in df.dtypes],
+        shape=list(df.shape),
+        md5=_hash_pandas(df),
+    )
+
+
+def _encode_label(label):
+    # Labels may be any hashable, e.g. numpy scalars
+    return label if isinstance(label, (basestring, int, long, float, bool, type(None))) else repr(label)
+
+
+def encode_bytes(val):
+    return _content(val, size=len(val), md5=buffer_digest(val))
+
+
+register('numpy:ndarray', encode_ndarray)
+register('pandas.core.series:Series', encode_series)
+register('pandas.core.frame:DataFrame', encode_dataframe)
+# str is text in python 2, so it is serialized as it is
+register(bytearray, encode_bytes)
+register(memoryview, encode_bytes)
+register(buffer, encode_bytes)
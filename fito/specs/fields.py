@@ -50,7 +50,7 @@ class Field(object):
         raise NotImplementedError()
 
     def check_valid_value(self, value):
-        return any([isinstance(value, t) for t in self.allowed_types])
+        return isinstance(value, tuple(self.allowed_types))
 
     def __eq__(self, other):
         return self is other
@@ -212,3 +212,128 @@ def UnboundSpecField(pos=None, default=_no_default, base_type=None, spec_field_s
 
 class UnboundPrimitiveField(PrimitiveField, UnboundField):
     pass
+
+
+class FieldSlot(object):
+    """
+    Replaces the fields of frozen :py:class:`Spec` subclasses, whose instances keep their values in the `_values` tuple.
+    Accessing it from the class gives the field back
+    """
+    __slots__ = ('index', 'field')
+
+    def __init__(self, index, field):
+        self.index = index
+        self.field = field
+
+    def __get__(self, instance, owner):
+        if instance is None: return self.field
+        return instance._values[self.index]
+
+    def __set__(self, instance, value):
+        raise AttributeError("{} instances are frozen".format(type(instance).__name__))
+
+
+class FieldTable(object):
+    """
+    Precomputed view over a group of fields (either the bound or the unbound ones) of an :py:class:`Spec` subclass
+    """
+    __slots__ = ('fields', 'names', 'positional', 'args_field', 'kwargs_field', 'defaults')
+
+    def __init__(self, fields):
+        args_field = None
+        kwargs_field = None
+        for attr_name, attr_type in fields:
+            if attr_type.pos is not None:
+                continue
+
+            elif isinstance(attr_type, KwargsField):
+                # KwargsField always have pos = None
+                if kwargs_field is not None:
+                    raise RuntimeError(
+                        "A spec can have at most one kwargs field, found {} and {}".format(attr_name, kwargs_field))
+                kwargs_field = attr_name
+
+            elif isinstance(attr_type, ArgsField):
+                if args_field is not None:
+                    raise RuntimeError(
+                        "A spec can have at most one args field, found {} and {}".format(attr_name, args_field))
+                args_field = attr_name
+
+        positional = sorted((attr_type.pos, attr_name) for attr_name, attr_type in fields if attr_type.pos is not None)
+
+        set_ = super(FieldTable, self).__setattr__
+        set_('fields', tuple(fields))
+        set_('names', frozenset(attr_name for attr_name, _ in fields))
+        set_('positional', tuple(attr_name for _, attr_name in positional))
+        set_('args_field', args_field)
+        set_('kwargs_field', kwargs_field)
+        set_('defaults', tuple(
+            (attr_name, attr_type.default)
+            for attr_name, attr_type in fields
+            if attr_type.has_default_value() and attr_name != args_field
+        ))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("{} instances are read only".format(type(self).__name__))
+
+    def __len__(self):
+        return len(self.fields)
+
+
+def _get_validator(field):
+    check = type(field).check_valid_value
+    if check.__func__ is Field.check_valid_value.__func__ and object in field.allowed_types:
+        # Any value is valid
+        return None
+    else:
+        return field.check_valid_value
+
+
+class FieldSchema(object):
+    """
+    Frozen description of the fields of an :py:class:`Spec` subclass.
+
+    It is built once by :py:class:`SpecMeta` when the class is created (and rebuilt if a field is later set on the
+    class), so that the hot paths do not need to introspect the class on every call.
+
+    :ivar fields: Tuple of (name, field) pairs sorted by name, the same order `dir` gives
+    :ivar by_name: Mapping from field name to field
+    :ivar bound: :py:class:`FieldTable` for the bound fields
+    :ivar unbound: :py:class:`FieldTable` for the unbound fields
+    :ivar serialized: Fields whose `serialize` flag is set
+    :ivar spec_fields: Names of the fields holding an Spec
+    :ivar primitive_fields: Names of the fields holding a primitive value
+    :ivar display_order: Fields sorted for __repr__ and doc strings
+    :ivar validators: Mapping from field name to the function that checks its values, or None if any value is valid
+    """
+    __slots__ = ('fields', 'by_name', 'bound', 'unbound', 'serialized', 'spec_fields', 'primitive_fields',
+                 'display_order', 'validators')
+
+    def __init__(self, fields):
+        fields = tuple(fields)
+
+        set_ = super(FieldSchema, self).__setattr__
+        set_('fields', fields)
+        set_('by_name', dict(fields))
+        set_('bound', FieldTable([(k, v) for k, v in fields if not isinstance(v, UnboundField)]))
+        set_('unbound', FieldTable([(k, v) for k, v in fields if isinstance(v, UnboundField)]))
+        set_('serialized', tuple((k, v) for k, v in fields if v.serialize))
+        set_('spec_fields', tuple(k for k, v in fields if isinstance(v, BaseSpecField)))
+        set_('primitive_fields', tuple(k for k, v in fields if isinstance(v, PrimitiveField)))
+        set_('display_order', tuple(sorted(fields, key=lambda x: x[1].pos or len(fields))))
+        set_('validators', {k: _get_validator(v) for k, v in fields})
+
+    @classmethod
+    def from_class(cls, spec_class):
+        fields = []
+        for k in dir(spec_class):
+            v = getattr(spec_class, k)
+            if isinstance(v, Field):
+                fields.append((k, v))
+        return cls(fields)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("{} instances are read only".format(type(self).__name__))
+
+    def __len__(self):
+        return len(self.fields)
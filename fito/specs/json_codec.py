@@ -0,0 +1,82 @@
+"""
+JSON encoding of spec keys and of :py:meth:`Spec.json` exports.
+
+Datetimes are encoded as `{"$date": <milliseconds since epoch, UTC>}` (the same format bson.json_util uses), and loaded
+back as naive UTC datetimes. The global json module is not modified
+"""
+import calendar
+import json
+from datetime import datetime, timedelta
+
+_epoch = datetime(1970, 1, 1)
+
+# bson.json_util and its options, imported on first use. False if bson is not installed
+_json_util = None
+
+
+def _get_json_util():
+    global _json_util
+    if _json_util is None:
+        try:
+            from bson import json_util
+            # Non timezone aware datetimes, as the ones built by object_hook
+            _json_util = json_util, json_util.JSONOptions(tz_aware=False)
+        except ImportError:
+            _json_util = False
+    return _json_util
+
+
+def default(obj):
+    if isinstance(obj, datetime):
+        if obj.utcoffset() is not None: obj = obj - obj.utcoffset()
+        return {'$date': int(calendar.timegm(obj.timetuple()) * 1000 + obj.microsecond // 1000)}
+    elif _get_json_util():
+        # Other bson types (e.g. ObjectId)
+        return _get_json_util()[0].default(obj)
+    else:
+        raise TypeError(repr(obj) + " is not JSON serializable")
+
+
+def object_hook(obj):
+    if len(obj) == 1 and isinstance(obj.get('$date'), (int, long)):
+        return _epoch + timedelta(milliseconds=obj['$date'])
+    elif _get_json_util():
+        json_util, json_options = _get_json_util()
+        return json_util.object_hook(obj, json_options=json_options)
+    else:
+        return obj
+
+
+class JsonCodec(object):
+    """
+    Has the dump(s)/load(s) interface of the json module, adding the encoding of datetimes.
+
+    Only documents that have a "$" key go through `object_hook`, the rest are fully parsed by the backend
+
+    :param backend: Module with the interface of json. Keys are built with it, so it must give the same output as the
+    json module does, otherwise the keys would depend on what is installed
+    """
+
+    def __init__(self, backend=json):
+        self.backend = backend
+
+    def dumps(self, obj, **kwargs):
+        kwargs.setdefault('default', default)
+        return self.backend.dumps(obj, **kwargs)
+
+    def dump(self, obj, f, **kwargs):
+        f.write(self.dumps(obj, **kwargs))
+
+    def loads(self, string):
+        if '"$' not in string:
+            return self.backend.loads(string)
+        else:
+            return self.backend.loads(string, object_hook=object_hook)
+
+    def load(self, f):
+        return self.loads(f.read())
+
+
+# The stdlib json module has C speedups for both encoding and decoding. Faster encoders, like ujson, format floats and
+# escape strings differently, which would change the keys
+codec = JsonCodec()
@@ -0,0 +1,119 @@
+"""
+Lazy views over serialized specs. They let data stores scan their keys without importing the module of every spec and
+building it
+"""
+import base
+
+
+class LazySpec(object):
+    """
+    Read only view over the dictionary of a serialized :py:class:`Spec`.
+
+    The type and the field values can be inspected without importing the module of the spec. The spec is only built
+    when :py:meth:`LazySpec.load` is called. Sub specs are also given as a LazySpec
+
+    >>> lazy = LazySpec.from_key(spec.serialized_key)
+    >>> lazy.type_name
+    'Experiment'
+    >>> lazy.load()
+    Experiment(...)
+    """
+    __slots__ = ('_dict', '_key', '_spec')
+
+    def __init__(self, dict, key=None):
+        """
+        :param dict: The output of :py:meth:`Spec.to_dict`, it must not be modified
+        :param key: The serialized key of the spec, if already known
+        """
+        self._dict = dict
+        self._key = key
+        self._spec = None
+
+    @classmethod
+    def from_key(cls, key):
+        return cls(base.Spec.key2dict(key), key=key)
+
+    @property
+    def type_path(self):
+        """
+        The import path of the class, as stored in the dictionary
+        """
+        return self._dict['type']
+
+    @property
+    def type_name(self):
+        """
+        The name of the class, it does not require importing it
+        """
+        import_path = self._dict['type']
+        if isinstance(import_path, dict):
+            return import_path['method']
+
+        if '@' in import_path:
+            raise ValueError("Can not handle operations that are methods of non spec classes")
+
+        return import_path.split(':')[1].split('.')[-1]
+
+    @property
+    def spec_class(self):
+        """
+        The class of the spec. Imports its module if it was not imported yet
+        """
+        return base.Spec.type2spec_class(self._dict['type'])
+
+    def isinstance_of(self, cls):
+        """
+        Same as `isinstance(self.load(), cls)`, without building the spec.
+        The module of the spec is only imported if its type is not exactly `cls`
+        """
+        if self._dict['type'] == base.get_import_path(cls): return True
+        return issubclass(self.spec_class, cls)
+
+    @property
+    def serialized_key(self):
+        if self._key is None:
+            self._key = base.Spec._dict2key(self._dict)
+        return self._key
+
+    @property
+    def digest(self):
+        return base.Spec.dict2digest(self._dict)
+
+    def load(self):
+        """
+        Builds the spec, only once
+        """
+        if self._spec is None:
+            self._spec = base.Spec.dict2spec(self._dict)
+        return self._spec
+
+    def to_dict(self):
+        return self._dict
+
+    def __getattr__(self, name):
+        try:
+            return _wrap(self._dict[name])
+        except KeyError:
+            raise AttributeError("{} has no field {}".format(self.type_path, name))
+
+    def __eq__(self, other):
+        return isinstance(other, LazySpec) and self.serialized_key == other.serialized_key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.serialized_key)
+
+    def __repr__(self):
+        return 'LazySpec({})'.format(self.type_path)
+
+
+def _wrap(val):
+    if isinstance(val, dict):
+        if 'type' in val: return LazySpec(val)
+        return {k: _wrap(v) for k, v in val.iteritems()}
+    elif isinstance(val, (list, tuple)):
+        return type(val)(_wrap(e) for e in val)
+    else:
+        return val
@@ -0,0 +1,58 @@
+"""
+Registries keyed by class, for extension points that dispatch on the type of a value
+"""
+
+
+def import_path(cls):
+    return '{}:{}'.format(cls.__module__, cls.__name__)
+
+
+class TypeRegistry(object):
+    """
+    Maps classes to values. A value registered for a class also applies to its subclasses.
+
+    Classes can be registered by import path ('module:Class'), so that optional dependencies (e.g. numpy) are not
+    imported to register them
+
+    >>> registry = TypeRegistry()
+    >>> registry.register('numpy:ndarray', encode_array)
+    >>> registry.get(type(value))
+    """
+
+    def __init__(self):
+        self._values = {}
+        # class -> value, or None if the class has none. Filled on first use of each class
+        self._resolved = {}
+
+    def register(self, cls, value):
+        """
+        :param cls: The class or its import path
+        """
+        if not isinstance(cls, basestring): cls = import_path(cls)
+        self._values[cls] = value
+        self._resolved.clear()
+
+    def unregister(self, cls):
+        """
+        :param cls: The class or its import path, as it was registered
+        """
+        if not isinstance(cls, basestring): cls = import_path(cls)
+        del self._values[cls]
+        self._resolved.clear()
+
+    def get(self, cls):
+        """
+        :return: The value registered for the closest class in the mro of `cls`, or None if there is none
+        """
+        try:
+            return self._resolved[cls]
+        except KeyError:
+            pass
+
+        res = None
+        for klass in cls.__mro__:
+            res = self._values.get(import_path(klass))
+            if res is not None: break
+
+        self._resolved[cls] = res
+        return res
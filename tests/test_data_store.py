@@ -248,5 +248,16 @@ class TestDataStore(unittest.TestCase):
                     raise e
 
 
+class TestGlobalClient(unittest.TestCase):
+    def test_override(self):
+        previous = mongo.global_client
+        mongo.global_client = {'db': {'coll': 'collection of the other client'}}
+        try:
+            assert mongo.get_global_client() is mongo.global_client
+            assert mongo.MongoHashMap('db.coll').coll == 'collection of the other client'
+        finally:
+            mongo.global_client = previous
+
+
 def func(i):
     return i
@@ -1,9 +1,26 @@
+import os
+import pickle
 import tempfile
 import unittest
+import warnings
+from collections import OrderedDict
+from multiprocessing import Pool
 
-from fito.data_store.file import FileDataStore, RawSerializer, PickleSerializer
+import yaml
+
+from fito import Spec
+from fito.data_store.dict_ds import DictDataStore
+from fito.data_store.file import FileDataStore, RawSerializer, PickleSerializer, CompressedPickleSerializer, \
+    CompressedRawSerializer, NumpySerializer, DataFrameSerializer, AutoSerializer
+from fito.specs.lazy import LazySpec
 from test_data_store import delete
-from test_spec import get_test_specs
+from test_spec import get_test_specs, SpecA, SpecB
+
+
+def save_many(ds):
+    for i in xrange(20):
+        ds[SpecA(i % 5)] = str(i % 5) * 10000
+        ds.get(SpecA(i % 5))
 
 
 class TestFileDataStore(unittest.TestCase):
@@ -39,7 +56,364 @@ class TestFileDataStore(unittest.TestCase):
 
             self.assertRaises(StopIteration, ds.iterkeys().next)
 
+    def test_key_hash(self):
+        for ds in self.data_stores:
+            assert ds.key_hash == 'digest'
+            ds[self.test_specs[0]] = ""
+            assert ds.get_digest(self.test_specs[0]) in ds._get_dir(self.test_specs[0]).replace(os.sep, '')
+
+        # Stores created before digests were introduced keep using mmh3
+        ds = self.data_stores[0]
+        conf_file = os.path.join(ds.path, 'conf.yaml')
+        with open(conf_file) as f:
+            conf = yaml.load(f)
+        conf.pop('key_hash')
+        with open(conf_file, 'w') as f:
+            yaml.dump(conf, f)
+
+        assert FileDataStore(ds.path).key_hash == 'mmh3'
+
+    def test_index(self):
+        specs = [SpecA(i) for i in xrange(10)] + [SpecB(spec_a=SpecA(i)) for i in xrange(3)]
+        for ds in self.data_stores:
+            assert ds.use_index
+            for i, spec in enumerate(specs):
+                ds[spec] = str(i)
+            ds.remove(specs[0])
+            assert len(ds.index) == len(specs) - 1
+
+            # It connects again once unpickled
+            index = pickle.loads(pickle.dumps(ds.index))
+            assert len(index) == len(specs) - 1 and index.fname == ds.index.fname
+
+            # Open it without the index, as stores created by older versions
+            conf_file = os.path.join(ds.path, 'conf.yaml')
+            with open(conf_file) as f:
+                conf = yaml.load(f)
+            conf.pop('use_index')
+            with open(conf_file, 'w') as f:
+                yaml.dump(conf, f)
+
+            old_ds = FileDataStore(ds.path, use_class_name=ds.use_class_name)
+            assert old_ds.index is None
+            assert sorted(old_ds.iterkeys()) == sorted(ds.iterkeys()) == sorted(specs[1:])
+
+            ds[specs[0]] = '0'
+            old_ds.rebuild_index()
+            assert FileDataStore(ds.path, use_class_name=ds.use_class_name).use_index
+            assert sorted(old_ds.iterkeys()) == sorted(specs)
+
+            for i, spec in enumerate(specs):
+                assert ds[spec] == old_ds[spec] == str(i)
+
+    def test_compressed_serializers(self):
+        data = {'matrix': [[i % 7] * 100 for i in xrange(1000)]}
+        raw_data = 'abc' * 100000
+        for serializer in [
+            CompressedPickleSerializer(), CompressedPickleSerializer('bz2', 1), CompressedRawSerializer('gzip', 9)
+        ]:
+            path = tempfile.mktemp()
+            try:
+                ds = FileDataStore(path, serializer=serializer)
+                value = raw_data if isinstance(serializer, CompressedRawSerializer) else data
+                ds[SpecA(0)] = value
+
+                fname = serializer.get_fname(ds.get_id(SpecA(0)))
+                assert fname.endswith('.gz') or fname.endswith('.bz2')
+                assert os.path.getsize(fname) < len(pickle.dumps(value, 2)) / 10
+
+                # The serializer is recorded in conf.yaml
+                ds = FileDataStore(path)
+                assert ds.serializer == serializer
+                assert ds[SpecA(0)] == value
+            finally:
+                delete(path)
+
+        self.assertRaises(ValueError, CompressedPickleSerializer, 'zip')
+
+    def test_numpy_serializer(self):
+        import numpy as np
+
+        arr = np.arange(20.).reshape(4, 5)
+        values = [arr, {'a': arr, 'b': np.arange(3)}, (arr, np.zeros(0)), [arr.astype('f4')]]
+
+        path = tempfile.mktemp()
+        try:
+            ds = FileDataStore(path, serializer=NumpySerializer())
+            for i, value in enumerate(values):
+                ds[SpecA(i)] = value
+
+            self.assertRaises(TypeError, ds.save, SpecA(10), np.array([None]))
+            self.assertRaises(TypeError, ds.save, SpecA(10), 'not an array')
+
+            loaded = ds[SpecA(0)]
+            assert isinstance(loaded, np.memmap) and not loaded.flags.writeable
+            assert (loaded == arr).all()
+
+            loaded = ds[SpecA(1)]
+            assert sorted(loaded) == ['a', 'b'] and (loaded['b'] == np.arange(3)).all()
+            assert type(ds[SpecA(2)]) is tuple and ds[SpecA(2)][1].shape == (0,)
+            assert type(ds[SpecA(3)]) is list and ds[SpecA(3)][0].dtype == np.float32
+
+            # Reading them in memory
+            ds = FileDataStore(path, serializer=NumpySerializer(mmap_mode=None))
+            assert not isinstance(ds[SpecA(0)], np.memmap) and (ds[SpecA(0)] == arr).all()
+        finally:
+            delete(path)
+
+    def test_data_frame_serializer(self):
+        import numpy as np
+        import pandas as pd
+
+        df = pd.DataFrame(OrderedDict([
+            ('a', np.arange(5)),
+            ('b', np.linspace(0, 1, 5)),
+            ('c', list('vwxyz')),
+            ('d', pd.Categorical(list('xxyyx'))),
+            ('e', pd.date_range('2017-01-01', periods=5, tz='UTC')),
+        ]))
+        dfs = [df, df.set_index('c'), df.iloc[::2], df[['a']].rename(columns={'a': 0})]
+
+        path = tempfile.mktemp()
+        try:
+            ds = FileDataStore(path, serializer=DataFrameSerializer('npy'))
+            for i, value in enumerate(dfs):
+                ds[SpecA(i)] = value
+                pd.testing.assert_frame_equal(ds[SpecA(i)], value)
+
+            pd.testing.assert_frame_equal(ds.get(SpecA(0), columns=['e', 'a']), df[['e', 'a']])
+            pd.testing.assert_frame_equal(ds.get(SpecA(2), columns=['d']), df.iloc[::2][['d']])
+            self.assertRaises(KeyError, ds.get, SpecA(0), columns=['f'])
+            self.assertRaises(TypeError, ds.save, SpecA(10), 'not a data frame')
+            self.assertRaises(ValueError, self.data_stores[0].get, SpecA(0), columns=['a'])
+
+            # The default does not depend on what is installed, so the store opens the same way on any host
+            assert DataFrameSerializer() == DataFrameSerializer('npy')
+            assert FileDataStore(path, serializer=DataFrameSerializer()).serializer.format == 'npy'
+        finally:
+            delete(path)
+
+    def test_auto_serializer(self):
+        import numpy as np
+        import pandas as pd
+
+        class Blob(str):
+            pass
+
+        AutoSerializer.register(Blob, CompressedRawSerializer())
+        self.addCleanup(AutoSerializer.unregister, Blob)
+        values = [np.arange(10), pd.DataFrame({'a': [1, 2], 'b': [3, 4]}), 'raw bytes', {'pickled': 1}, Blob('b' * 100)]
+        expected = [
+            NumpySerializer(), DataFrameSerializer(), RawSerializer(), PickleSerializer(), CompressedRawSerializer()
+        ]
+
+        path = tempfile.mktemp()
+        try:
+            ds = FileDataStore(path, serializer=AutoSerializer())
+            for i, (value, serializer) in enumerate(zip(values, expected)):
+                ds[SpecA(i)] = value
+                assert ds.serializer.get_entry_serializer(ds.get_id(SpecA(i))) == serializer
+
+            assert isinstance(ds[SpecA(0)], np.memmap)
+            assert ds[SpecA(2)] == 'raw bytes' and ds[SpecA(3)] == {'pickled': 1} and ds[SpecA(4)] == 'b' * 100
+            assert ds.get(SpecA(1), columns=['b'])['b'].tolist() == [3, 4]
+            self.assertRaises(ValueError, ds.get, SpecA(3), columns=['b'])
+        finally:
+            delete(path)
+
+    def test_packs(self):
+        path = tempfile.mktemp()
+        try:
+            ds = FileDataStore(path, pack_threshold=1000)
+            specs = [SpecA(i) for i in xrange(50)]
+            for i, spec in enumerate(specs):
+                ds[spec] = i
+            ds[SpecB(spec_a=SpecA(0))] = 'x' * 5000
+
+            # Only the large entry has its own subdir
+            assert len(list(ds._iter_subdirs())) == 1 and len(os.listdir(ds.packs_dir)) == 1
+            assert all(ds[spec] == i for i, spec in enumerate(specs)) and specs[0] in ds
+            assert sorted(ds.scan(values=True)) == sorted(zip(specs, range(50)) + [(SpecB(spec_a=SpecA(0)), 'x' * 5000)])
+
+            ds[ds.get_id(specs[1])] = 'one'
+            ds[specs[2]] = 'x' * 5000
+            ds[SpecB(spec_a=SpecA(0))] = 'small'
+            ds.remove(specs[3])
+            assert len(list(ds._iter_subdirs())) == 1
+            expected = dict(zip(specs, range(50)))
+            expected.update({specs[1]: 'one', specs[2]: 'x' * 5000, SpecB(spec_a=SpecA(0)): 'small'})
+            expected.pop(specs[3])
+            assert dict(ds.iteritems()) == expected
+
+            # Stores can be sent to other processes, copies append to their own segments
+            ds_copy = pickle.loads(pickle.dumps(ds))
+            assert ds_copy[specs[1]] == 'one'
+            ds_copy[specs[4]] = 'four'
+            assert ds[specs[4]] == 'four' and len(os.listdir(ds.packs_dir)) == 2
+            expected[specs[4]] = 'four'
+
+            # The index can be rebuilt from the segments, removed entries stay removed
+            os.remove(ds.index.fname)
+            ds.rebuild_index()
+            assert dict(ds.iteritems()) == expected
+
+            size = sum(os.path.getsize(os.path.join(ds.packs_dir, f)) for f in os.listdir(ds.packs_dir))
+            assert ds.compact_packs() > 0
+            assert ds.compact_packs() == 0
+            assert dict(ds.iteritems()) == expected
+            assert sum(os.path.getsize(os.path.join(ds.packs_dir, f)) for f in os.listdir(ds.packs_dir)) < size
+
+        finally:
+            delete(path)
+
+        path = tempfile.mktemp()
+        try:
+            self.assertRaises(ValueError, FileDataStore, path, use_index=False, pack_threshold=1000)
+        finally:
+            delete(path)
+
+    def test_copy_value(self):
+        from fito.data_store.refactor import StorageRefactor
+
+        for ds in self.data_stores:
+            ds[SpecA(0)] = 'x' * 1000
+            ds.copy_value(SpecA(0), SpecA(1))
+            ds.copy_value(SpecA(0), SpecB(spec_a=SpecA(0)))
+
+            # The files are shared, not copied
+            fname = ds.serializer.get_fname(ds.get_id(SpecA(0)))
+            assert os.stat(fname).st_nlink == 3
+            assert os.stat(fname).st_ino == os.stat(ds.serializer.get_fname(ds.get_id(SpecA(1)))).st_ino
+
+            ds.remove(SpecA(0))
+            ds[SpecA(1)] = 'y'
+            assert ds[SpecB(spec_a=SpecA(0))] == 'x' * 1000 and ds[SpecA(1)] == 'y'
+
+            out_ds = FileDataStore(tempfile.mktemp(), serializer=ds.serializer, use_class_name=ds.use_class_name)
+            try:
+                ds.refactor(StorageRefactor().add_field(SpecA, 'field2', 1), out_ds)
+                assert out_ds[SpecA(1, field2=1)] == 'y' and out_ds[SpecB(spec_a=SpecA(0, field2=1))] == 'x' * 1000
+                assert os.stat(out_ds.serializer.get_fname(out_ds.get_id(SpecA(1, field2=1)))).st_nlink == 2
+            finally:
+                delete(out_ds.path)
+
+        # Packed values are written again, to other stores the value is copied
+        path = tempfile.mktemp()
+        try:
+            ds = FileDataStore(path, pack_threshold=1000)
+            ds[SpecA(0)] = 1
+            ds.copy_value(SpecA(0), SpecA(1))
+            self.data_stores[2].copy_value(SpecA(0), SpecA(2), source=ds)
+            assert ds[SpecA(1)] == 1 and self.data_stores[2][SpecA(2)] == 1
+        finally:
+            delete(path)
+
+    def test_lazy_iterkeys(self):
+        spec = SpecB(spec_a=SpecA(1))
+        for ds in self.data_stores:
+            ds[spec] = '1'
+            ds[SpecA(2)] = '2'
+
+            lazy_specs = sorted(ds.iterkeys(lazy=True), key=lambda lazy: lazy.type_name)
+            assert [lazy.type_name for lazy in lazy_specs] == ['SpecA', 'SpecB']
+
+            lazy = lazy_specs[1]
+            assert lazy.isinstance_of(SpecB) and lazy.isinstance_of(Spec) and not lazy.isinstance_of(SpecA)
+            assert isinstance(lazy.spec_a, LazySpec)
+            assert lazy.spec_a.field1 == 1
+            assert lazy.load() == spec
+            assert ds[lazy] == '1' and lazy in ds
+
+            ds.clean(SpecB)
+            assert [lazy.type_name for lazy in ds.iterkeys(lazy=True)] == ['SpecA']
+
+        # The module of the spec is not needed to inspect it
+        lazy = LazySpec({'type': 'not_a_module:Experiment', 'param': 1})
+        assert lazy.type_name == 'Experiment' and lazy.param == 1
+        self.assertRaises(AttributeError, getattr, lazy, 'other_param')
+
+    def test_scan(self):
+        specs = [SpecA(i) for i in xrange(25)] + [SpecB(spec_a=SpecA(i)) for i in xrange(5)]
+        for ds in self.data_stores + [DictDataStore()]:
+            for i, spec in enumerate(specs):
+                ds[spec] = str(i)
+
+            for n_threads in (0, 3):
+                scanned = list(ds.scan(batch_size=4, n_threads=n_threads))
+                assert sorted(scanned) == sorted(specs)
+
+                scanned = list(ds.scan(where=lambda d: d.get('field1') > 20, values=True, n_threads=n_threads))
+                assert sorted(scanned) == [(SpecA(i), str(i)) for i in xrange(21, 25)]
+
+            raw = list(ds.scan(where=lambda d: 'spec_a' in d, raw=True))
+            assert sorted(Spec.dict2spec(d) for d in raw) == sorted(specs[25:])
+            assert all(isinstance(lazy, LazySpec) for lazy in ds.scan(lazy=True))
+
+            similar = ds.find_similar(SpecA(3), limit=3)
+            assert len(similar) == 3 and similar[0][0] == SpecA(3)
+            assert similar[0][1] > similar[1][1] >= similar[2][1]
+
+    def test_refactor_corrupt_value(self):
+        from fito.data_store.refactor import StorageRefactor
+
+        ds = self.data_stores[2]
+        for i in xrange(5):
+            ds[SpecA(i)] = i
+        with open(ds.serializer.get_fname(ds.get_id(SpecA(2))), 'w') as f:
+            f.write('not a pickle')
+
+        refactor = StorageRefactor().add_field(SpecA, 'field2', 1)
+        self.assertRaises(Exception, ds.refactor, refactor, DictDataStore())
+
+        out_ds = DictDataStore()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            ds.refactor(refactor, out_ds, permissive=True, n_threads=2)
+        assert len(caught) == 1
+        assert sorted(out_ds.iteritems()) == [(SpecA(i, field2=1), i) for i in (0, 1, 3, 4)]
+
+        scanned = dict(ds.scan(values=True, on_error=lambda d, e: 'failed'))
+        assert scanned[SpecA(2)] == 'failed' and scanned[SpecA(3)] == 3
+
+    def test_missing_subdir(self):
+        for ds in self.data_stores:
+            ds[SpecA(1)] = 'a'
+            ds[SpecA(2)] = 'b'
+
+            # Removed without going through the store, the index still lists it
+            delete(ds.get_id(SpecA(1)))
+            self.assertRaises(KeyError, ds.get, SpecA(1))
+            assert SpecA(1) not in ds and len(ds.index) == 1
+            assert ds[SpecA(2)] == 'b'
+
+    def test_concurrent_writers(self):
+        no_index = FileDataStore(tempfile.mktemp(), use_index=False)
+        self.data_stores.append(no_index)
+
+        for ds in self.data_stores:
+            pool = Pool(8)
+            try:
+                pool.map(save_many, [ds] * 16)
+            finally:
+                pool.terminate()
 
+            for i in xrange(5):
+                assert ds[SpecA(i)] == str(i) * 10000
 
+            # Every published entry is complete, and each key has only one
+            subdirs = list(ds._iter_subdirs())
+            assert len(subdirs) == 5
+            for subdir in subdirs:
+                assert ds.serializer.exists(subdir)
+            if ds.index is not None:
+                assert len(ds.index) == 5
+                assert sorted(key for _, key in ds.index.iterkeys()) == sorted(ds.get_key(SpecA(i)) for i in xrange(5))
 
+            ds.remove(SpecA(0))
+            assert SpecA(0) not in ds
+            assert len(list(ds._iter_subdirs())) == 4
 
+            # Saving again by id replaces the whole entry
+            ds[ds.get_id(SpecA(1))] = 'x'
+            assert ds[SpecA(1)] == 'x'
+            assert len(list(ds._iter_subdirs())) == 4
@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# Optional subsystems that must not be imported by `import fito`
+heavy_modules = ['cmd2', 'yaml', 'bson', 'pymongo', 'gridfs', 'sklearn', 'pandas', 'numpy', 'pyarrow']
+
+script = """
+import json, sys, time
+t0 = time.time()
+import fito, fito.data_store, fito.model
+elapsed = time.time() - t0
+print json.dumps({'elapsed': elapsed, 'loaded': [m for m in %r if m in sys.modules]})
+""" % heavy_modules
+
+
+def import_fito():
+    """
+    Imports fito in a new interpreter
+    :return: The dict {'elapsed': import time in seconds, 'loaded': list of heavy modules that were imported}
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+    return json.loads(output.splitlines()[-1])
+
+
+class TestImportTime(unittest.TestCase):
+    def test_lazy_imports(self):
+        res = import_fito()
+        assert res['loaded'] == [], res['loaded']
+
+
+if __name__ == '__main__':
+    res = min((import_fito() for _ in xrange(5)), key=lambda x: x['elapsed'])
+    print 'import fito: {:.3f}s, heavy modules loaded: {}'.format(res['elapsed'], res['loaded'])
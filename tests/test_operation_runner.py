@@ -3,6 +3,9 @@ import inspect
 import unittest
 from random import Random
 
+import numpy as np
+
+from fito import as_operation
 from fito.operation_runner import OperationRunner
 from fito.operations.operation import Operation
 from fito.specs.fields import NumericField, SpecField
@@ -45,6 +48,15 @@ class MultiplyOperation(Numeric):
         return '{} * {}'.format(self.a, self.b)
 
 
+calls = []
+
+
+@as_operation()
+def array_sum(data):
+    calls.append(data)
+    return data.sum()
+
+
 class TestOperation(unittest.TestCase):
     def setUp(self):
         # create some numbers
@@ -105,3 +117,15 @@ class TestOperation(unittest.TestCase):
             for op in self.operations:
                 assert op.times_run == cardinality[op] * (i + 1)
 
+    def test_data_arguments(self):
+        runner = OperationRunner(execute_cache_size=10)
+        del calls[:]
+
+        data = np.arange(10)
+        assert runner.execute(array_sum(data)) == 45
+        # Same contents, different object
+        assert runner.execute(array_sum(data.copy())) == 45
+        assert len(calls) == 1
+
+        assert runner.execute(array_sum(data * 2)) == 90
+        assert len(calls) == 2
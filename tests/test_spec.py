@@ -1,18 +1,22 @@
+import gc
 import os
+import pickle
 from tempfile import mktemp, mkdtemp
 import warnings
 from StringIO import StringIO
 import unittest
+import weakref
 from datetime import datetime
 from random import Random
 
 import re
 import shutil
+import sys
 import yaml
 
 from fito import Spec, SpecField, PrimitiveField
 from fito.specs.fields import NumericField, CollectionField, SpecCollection, BaseSpecField, \
-    KwargsField, ArgsField
+    KwargsField, ArgsField, UnboundPrimitiveField
 from fito.specs.base import InvalidSpecInstance
 from fito.specs.utils import general_append
 from fito.specs import base as specs_base
@@ -55,6 +59,36 @@ class SpecWithDefault(Spec):
     a = SpecField(default=SpecA(10))
 
 
+class MerkleB(SpecB):
+    merkle_keys = True
+
+
+class MerkleC(SpecC):
+    merkle_keys = True
+
+
+class FrozenA(Spec):
+    frozen = True
+    field1 = NumericField(0)
+    field2 = PrimitiveField(default=None)
+    verbose = PrimitiveField(default=False, serialize=False)
+    bound_later = UnboundPrimitiveField(default=None)
+
+
+class InternedA(Spec):
+    frozen = True
+    interned = True
+    field1 = PrimitiveField(0)
+    verbose = PrimitiveField(default=False, serialize=False)
+    bound_later = UnboundPrimitiveField(default=None)
+
+
+class FrozenB(Spec):
+    frozen = True
+    spec_a = SpecField(0)
+    spec_list = SpecCollection(default=[])
+
+
 def get_test_specs(only_lists=True, easy=False):
     if easy:
         warnings.warn("get_test_specs(easy=True)")
@@ -125,6 +159,19 @@ class TestSpec(unittest.TestCase):
     def test_json_serializable(self):
         self._test_serialization('json')
 
+    def test_json_codec(self):
+        import json
+        from fito.specs import json_codec
+
+        # The global json module is left as it is
+        self.assertRaises(TypeError, json.dumps, datetime(2017, 1, 1))
+
+        spec = SpecA(1, datetime(2017, 1, 1, 10, 30, 0, 123000))
+        assert '{"$date": 1483266600123}' in spec.key
+        assert Spec.key2spec(spec.key) == spec
+        assert Spec.from_json().loads(spec.json.dumps()) == spec
+        assert json_codec.codec.loads('{"a": {"b": [1, "$"]}}') == {'a': {'b': [1, '$']}}
+
     def test_yaml_serializable(self):
         self._test_serialization('yaml')
 
@@ -184,6 +231,27 @@ class TestSpec(unittest.TestCase):
         for spec in self.instances:
             assert spec.to_dict() == spec.copy().to_dict()
 
+        # The key is carried over when there are no sub specs that could change
+        spec = SpecA(0)
+        key = spec.key
+        assert spec.copy().__dict__['_key'] is key
+
+        spec = SpecB(spec_a=SpecA(0))
+        key = spec.key
+        copy = spec.copy()
+        # The sub specs are not shared, so neither is the key
+        assert copy.spec_a is not spec.spec_a
+        assert '_key' not in copy.__dict__
+
+        copy.spec_a.field1 = 1
+        assert spec.spec_a.field1 == 0
+        assert copy.key != spec.key and copy != spec
+
+        spec = SpecD(SpecA(0), SpecA(1), a=SpecA(2))
+        copy = spec.copy()
+        assert copy.to_dict() == spec.to_dict()
+        assert copy.the_args[0] is not spec.the_args[0]
+
     def test_replace(self):
         for spec in self.instances:
             for field_name, field_spec in spec.get_fields():
@@ -206,14 +274,344 @@ class TestSpec(unittest.TestCase):
                 replaced_spec_dict = spec.replace(**{field_name: replace_val}).to_dict(include_all=True)
                 assert replaced_spec_dict == spec_dict
 
+        spec = SpecA(0)
+        key = spec.key
+        assert spec.replace(verbose=True).__dict__['_key'] == key
+        assert '_key' not in spec.replace(field1=1).__dict__
+
+    def test_codec(self):
+        class SpecList(list):
+            pass
+
+        d = SpecC(SpecList([SpecA(0), SpecA(1)])).to_dict()
+        assert type(d['spec_list']) is SpecList
+        assert d['spec_list'] == [SpecA(0).to_dict(), SpecA(1).to_dict()]
+
+        assert SpecC((SpecA(0),)).to_dict()['spec_list'] == (SpecA(0).to_dict(),)
+        assert SpecC({'a': SpecA(0)}).to_dict()['spec_list'] == {'a': SpecA(0).to_dict()}
+
+        # Dictionaries with a type are loaded, the rest of the collections are traversed
+        spec = SpecD(SpecA(0), a=SpecA(1))
+        spec.the_args = (SpecA(0), [SpecA(1), {'b': SpecA(2), 'c': 1}], {'d': 2})
+        assert Spec.dict2spec(spec.to_dict()).the_args == spec.the_args
+
+        d = spec.to_dict()
+        d['the_args'] = [{'type': 'NotASpec'}]
+        self.assertRaises(ValueError, Spec.dict2spec, d)
+
+        spec = SpecA(0, 'import os', func=SpecA)
+        d = spec.to_dict()
+        assert d['field2'] == '!!import os'
+        assert d['func'] == 'import {}:SpecA'.format(__name__)
+        assert Spec.dict2spec(d).field2 == 'import os'
+        assert Spec.dict2spec(d).func is SpecA
+
     def test_key(self):
         for spec in self.instances:
             assert spec.to_dict() == Spec.key2spec(spec.key).to_dict()
 
+    def test_field_schema(self):
+        schema = SpecA._schema
+        assert [name for name, _ in schema.fields] == ['field1', 'field2', 'func', 'verbose']
+        assert schema.bound.positional == ('field1', 'field2')
+        assert 'verbose' not in dict(schema.serialized)
+        assert SpecD._schema.bound.args_field == 'the_args'
+        assert SpecD._schema.bound.kwargs_field == 'the_kwargs'
+
+        # Setting a field on the class after its creation rebuilds the schema
+        class SpecE(Spec):
+            a = PrimitiveField(0)
+
+        class SpecF(SpecE):
+            pass
+
+        assert 'b' not in SpecF(0).to_dict()
+
+        SpecE.b = PrimitiveField(default=1)
+        assert 'b' in SpecE._schema.by_name
+        assert 'b' in SpecF._schema.by_name
+        assert SpecF(0).b == 1
+        # The codec is compiled again
+        assert SpecF(0).to_dict()['b'] == 1
+
+        del SpecE.b
+        assert 'b' not in SpecF._schema.by_name
+
+    def test_merkle_keys(self):
+        spec = MerkleB(spec_a=SpecA(0))
+        assert spec.key == MerkleB(spec_a=SpecA(0)).key
+        assert spec.key != MerkleB(spec_a=SpecA(1)).key
+        assert spec == MerkleB(spec_a=SpecA(0))
+
+        # The key only references the digest of the sub spec
+        assert spec.spec_a.key not in spec.key
+        assert Spec.key2spec(spec.serialized_key) == spec
+
+        # The serialized key is cached like the key, and dropped when a field changes
+        assert spec.serialized_key is spec.serialized_key
+        spec.spec_a = SpecA(1)
+        assert Spec.key2spec(spec.serialized_key) == MerkleB(spec_a=SpecA(1))
+        assert spec.replace(spec_a=SpecA(2)).serialized_key == MerkleB(spec_a=SpecA(2)).serialized_key
+
+        # Sub specs keys are reused
+        spec_a = SpecA(0)
+        spec_a_key = spec_a.key
+        spec_a.__dict__['_key'] = spec_a_key + ' '
+        assert MerkleC([spec_a]).key != MerkleC([SpecA(0)]).key
+
+    def test_frozen(self):
+        spec = FrozenA(1)
+        self.assertRaises(AttributeError, setattr, spec, 'field1', 2)
+        self.assertRaises(AttributeError, setattr, spec, 'other', 2)
+        self.assertRaises(AttributeError, spec.inplace_bind, 1)
+        assert spec.field1 == 1 and spec.field2 is None
+        assert isinstance(spec.bound_later, UnboundPrimitiveField)
+        assert FrozenA.field1 is FrozenA._schema.by_name['field1']
+
+        # The key is computed once
+        assert spec.key is spec.key
+        assert spec == FrozenA(1) and hash(spec) == hash(FrozenA(1))
+        assert Spec.dict2spec(spec.to_dict()) == spec
+
+        # Copies share frozen specs
+        spec_b = FrozenB(spec, spec_list=[spec, SpecA(0)])
+        assert spec_b.copy() is spec_b
+        spec_c = SpecC([spec])
+        key = spec_c.key
+        assert spec_c.copy().spec_list[0] is spec
+        assert spec_c.copy().__dict__['_key'] is key
+
+        replaced = spec.replace(field2=3)
+        assert replaced.field2 == 3 and spec.field2 is None
+        assert replaced.key != spec.key
+        assert spec.replace(verbose=True)._key is spec.key
+
+        bound = spec.bind(bound_later=2)
+        assert bound.bound_later == 2
+        assert isinstance(spec.bound_later, UnboundPrimitiveField)
+
+        class FrozenSubclass(FrozenA):
+            field3 = PrimitiveField(default=3)
+
+        assert FrozenSubclass(0).field3 == 3
+        assert FrozenSubclass(0).field1 == 0
+
+        self.assertRaises(RuntimeError, setattr, FrozenA, 'field4', PrimitiveField(default=0))
+
+        def unfreeze():
+            class Unfrozen(FrozenA):
+                frozen = False
+
+        self.assertRaises(ValueError, unfreeze)
+
+    def test_pickle_frozen(self):
+        spec = FrozenB(FrozenA(1, verbose=True).bind(bound_later=2), spec_list=[SpecA(0)])
+        for protocol in (0, 2):
+            res = pickle.loads(pickle.dumps(spec, protocol))
+            assert res == spec and res.spec_a.verbose and res.spec_a.bound_later == 2
+            assert isinstance(pickle.loads(pickle.dumps(FrozenA(1), protocol)).bound_later, UnboundPrimitiveField)
+
+            # Interned specs are loaded as the canonical instance
+            interned = InternedA(1)
+            assert pickle.loads(pickle.dumps(interned, protocol)) is interned
+
+    def test_interned(self):
+        spec = InternedA(1)
+        assert InternedA(1) is spec
+        assert InternedA(2) is not spec and InternedA(2) != spec
+        assert Spec.dict2spec(spec.to_dict()) is spec
+        assert FrozenB(spec).spec_a is spec
+        assert Spec.dict2spec(FrozenB(spec).to_dict()).spec_a is spec
+
+        assert spec.replace(field1=2) is InternedA(2)
+        assert spec.bind(bound_later=2) is InternedA(1, bound_later=2)
+        assert isinstance(spec.bound_later, UnboundPrimitiveField)
+
+        # Fields that are not serialized are not dropped
+        verbose = InternedA(1, verbose=True)
+        assert verbose.verbose and verbose is not spec and verbose == spec
+        assert InternedA(1, verbose=True) is verbose and spec.replace(verbose=True) is verbose
+        assert InternedA(1, verbose=general_append).verbose is general_append
+        # Values that can not be encoded keep the spec from being interned
+        value = object()
+        assert InternedA(1, verbose=value).verbose is value
+
+        # Instances that were not interned are still equal to the canonical one
+        assert type.__call__(InternedA, 1) == spec
+
+        # The table does not keep specs alive
+        intern_key = InternedA(3)._intern_key()
+        assert intern_key not in specs_base._interned_specs
+        ref = weakref.ref(InternedA(4))
+        gc.collect()
+        assert ref() is None
+
+        # A redefined class, as after a reload, does not get the instances of the old one
+        def define():
+            class Reloaded(Spec):
+                frozen = True
+                interned = True
+                field1 = PrimitiveField(0)
+            return Reloaded
+
+        old_cls, new_cls = define(), define()
+        old = old_cls(1)
+        assert type(new_cls(1)) is new_cls and new_cls(1) is new_cls(1) and old_cls(1) is old
+
+        class InternedSubclass(InternedA):
+            pass
+
+        assert InternedSubclass(1) is InternedSubclass(1)
+        assert InternedSubclass(1) != spec
+
+        def not_frozen():
+            class NotFrozen(Spec):
+                interned = True
+
+        self.assertRaises(ValueError, not_frozen)
+
+    def test_dict2spec_many(self):
+        dicts = [spec.to_dict() for spec in self.instances]
+        for batch_size in (1, 3, 1000):
+            specs = list(Spec.dict2spec_many(iter(dicts), batch_size=batch_size))
+            assert specs == self.instances
+
+        invalid = [SpecA(0).to_dict(), {'type': 'NotASpec'}, {'type': SpecA(0).to_dict()['type']}]
+        self.assertRaises(ValueError, list, Spec.dict2spec_many(invalid))
+        specs = list(Spec.dict2spec_many(invalid, on_error=lambda d, e: d))
+        assert specs == [SpecA(0), invalid[1], invalid[2]]
+
+    def test_from_records(self):
+        rows = [{'field1': i, 'field2': i % 2} for i in xrange(10)] + [{'field1': 10, 'verbose': True}]
+        specs = SpecA.from_records(rows, compute_keys=True)
+        assert specs == [SpecA(**row) for row in rows]
+        assert specs[-1].verbose and specs[-1].field2 is None
+        assert all(spec._key is not None for spec in specs)
+
+        specs = SpecA.from_columns(field1=range(3), field2=['a', 'b', 'c'])
+        assert specs == [SpecA(0, 'a'), SpecA(1, 'b'), SpecA(2, 'c')]
+
+        assert FrozenA.from_records([{'field1': 0}]) == [FrozenA(0)]
+        assert InternedA.from_records([{'field1': 0}])[0] is InternedA(0)
+        assert SpecD.from_records([{'a': 1}]) == [SpecD(a=1)]
+
+        import numpy as np
+        arr = np.array([(0, 1.5), (1, 2.5)], dtype=[('field1', int), ('field2', float)])
+        assert SpecA.from_records(arr) == [SpecA(0, 1.5), SpecA(1, 2.5)]
+
+        import pandas as pd
+        assert SpecA.from_records(pd.DataFrame(arr)) == [SpecA(0, 1.5), SpecA(1, 2.5)]
+
+        self.assertRaises(InvalidSpecInstance, SpecA.from_records, [{'field1': 'not a number'}])
+        self.assertRaises(InvalidSpecInstance, SpecA.from_records, [{'field2': 0}])
+        self.assertRaises(InvalidSpecInstance, SpecA.from_records, [{'field1': 0, 'foo': 0}])
+        self.assertRaises(ValueError, SpecA.from_columns, field1=[0], field2=[0, 1])
+
+    def test_content_hash(self):
+        import numpy as np
+        import pandas as pd
+
+        arr = np.arange(12.).reshape(3, 4)
+        values = [
+            arr, arr.T, arr[:, ::2], arr.astype(int), np.array(['a', None]),
+            pd.Series([1, 2], name='x'), pd.DataFrame(arr, columns=list('abcd')), bytearray('data')
+        ]
+        specs = [SpecA(0, val) for val in values]
+
+        for spec, val in zip(specs, values):
+            # The key depends on the contents only
+            assert spec == SpecA(0, bytearray(val) if isinstance(val, bytearray) else val.copy())
+            assert spec.to_dict()['field2']['$content']
+            repr(spec)
+
+        assert len(set(spec.key for spec in specs)) == len(specs)
+        assert SpecA(0, arr[:, ::2]) == SpecA(0, np.ascontiguousarray(arr[:, ::2]))
+        assert SpecA(0, arr) != SpecA(0, arr + 1)
+        assert SpecA(0, arr) != SpecA(0, arr.reshape(4, 3))
+
+    def test_digest(self):
+        for spec in self.instances:
+            assert len(spec.digest) == 32
+            assert spec.digest == Spec.dict2digest(spec.to_dict())
+            assert spec.digest == spec.copy().digest
+
+        spec = MerkleB(spec_a=SpecA(0))
+        assert spec.digest == Spec.dict2digest(spec.to_dict())
+
+        spec = SpecA(0)
+        digest = spec.digest
+        spec.field1 = 1
+        assert spec.digest != digest
+
     def test_type2spec_class(self):
         assert Spec == Spec.type2spec_class('fito:Spec')
         assert Spec == Spec.type2spec_class('fito.specs.base:Spec')
 
+    def test_import_path_cache(self):
+        tmp_dir = mkdtemp()
+        try:
+            with open(os.path.join(tmp_dir, 'reloadable_specs.py'), 'w') as f:
+                f.write('from fito import Spec\nclass ReloadableSpec(Spec): pass\n')
+
+            sys.path.insert(0, tmp_dir)
+            import reloadable_specs
+
+            path = 'reloadable_specs:ReloadableSpec'
+            cls = specs_base.obj_from_path(path)
+            assert cls is reloadable_specs.ReloadableSpec
+            assert specs_base.obj_from_path(path) is cls
+            assert specs_base.get_import_path(cls) == path
+
+            # Reloading the module invalidates the cached resolution
+            reload(reloadable_specs)
+            assert specs_base.obj_from_path(path) is reloadable_specs.ReloadableSpec
+            assert specs_base.obj_from_path(path) is not cls
+            assert Spec.type2spec_class(path) is reloadable_specs.ReloadableSpec
+
+            # The caches do not keep the replaced class alive
+            ref = weakref.ref(cls)
+            del cls
+            gc.collect()
+            assert ref() is None
+
+            def make_class():
+                class Dynamic(Spec):
+                    pass
+                specs_base.get_import_path(Dynamic)
+                reloadable_specs.Dynamic = Dynamic
+                assert specs_base.obj_from_path('reloadable_specs:Dynamic') is Dynamic
+                del reloadable_specs.Dynamic
+                return weakref.ref(Dynamic)
+
+            ref = make_class()
+            gc.collect()
+            assert ref() is None
+        finally:
+            sys.path.remove(tmp_dir)
+            sys.modules.pop('reloadable_specs', None)
+            shutil.rmtree(tmp_dir)
+
+    def test_type2spec_class_registry(self):
+        assert SpecA is Spec.type2spec_class('SpecA')
+        assert SpecA is Spec.type2spec_class('{}:SpecA'.format(__name__))
+
+        # Redefining a class replaces the registered one
+        class SpecG(Spec):
+            pass
+
+        old_spec_g = SpecG
+
+        class SpecG(Spec):
+            a = PrimitiveField(default=0)
+
+        assert Spec.type2spec_class('SpecG') is SpecG
+        assert Spec.type2spec_class('SpecG') is not old_spec_g
+
+        # Changing the module updates the import path
+        SpecG.__module__ = 'some.module'
+        assert specs_base._spec_classes_by_path['some.module:SpecG'] is SpecG
+        assert '{}:SpecG'.format(__name__) not in specs_base._spec_classes_by_path
+
     def test_serialize(self):
         s = SpecA(0, verbose=True)
         assert 'verbose' not in s.to_dict()